@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import StoredCart, StoredCartLine
 
-# Register your models here.
+
+class StoredCartLineInline(admin.TabularInline):
+    model = StoredCartLine
+    extra = 0
+    readonly_fields = ('perfume', 'capacity', 'quantity', 'price')
+    can_delete = False
+
+
+@admin.register(StoredCart)
+class StoredCartAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'user', 'updated_at', 'created_at')
+    list_filter = (('user', admin.EmptyFieldListFilter),)
+    search_fields = ('user__email', 'token')
+    readonly_fields = ('user', 'token', 'samples', 'gift_wrap', 'special_instructions', 'created_at', 'updated_at')
+    inlines = [StoredCartLineInline]
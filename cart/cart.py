@@ -1,114 +1,170 @@
-from django.conf import settings
-from main.models import Perfume, Capacity
 from decimal import Decimal
 from main.models import Perfume, PerfumeCapacity, Capacity
+from .storage import get_cart_storage
+
+
+def get_cart(request):
+    """Одна корзина на запрос: представления, шаблоны и платёжные функции читают одни и те же строки"""
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
+
+
+class CartSnapshot:
+    """Строки и итоги корзины, посчитанные один раз"""
+
+    def __init__(self, items, item_count, discount):
+        self.items = items
+        self.item_count = item_count
+        self.subtotal = sum((item['total_price'] for item in items), Decimal(0))
+        self.discount = discount
+        self.discounted_total = self.subtotal * (Decimal(1) - discount / Decimal(100))
+
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+    def __len__(self):
+        return self.item_count
 
 
 class Cart:
     def __init__(self, request):
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {
-                'products': {},
-                'samples': [],
-                'gift_wrap': None,
-                'special_instructions': ''
-            }
-        self.cart = cart
+        # Где лежит корзина, решает CART_STORAGE: сессия или хэш в Redis
+        self.storage = get_cart_storage(request)
+        self.cart = self.storage.load()
+        # Менялась ли корзина в этом запросе — тогда CartCountCookieMiddleware обновит счётчик в куке
+        self.modified = False
+        # Строки корзины с загруженными объектами; сбрасываются при любом изменении
+        self._items = None
+        self._snapshot = None
 
 
     def add(self, perfume, capacity, quantity=1, override_quantity=False):
         key = f"{perfume.id}_{capacity.id}"
-        if key not in self.cart['products']:
-            self.cart['products'][key] = {
-                'quantity': 0,
-                'perfume_id': perfume.id,
-                'capacity_id': capacity.id,
-                'price': str(self._get_price(perfume, capacity))
-            }
-        
-        if override_quantity:
-            self.cart['products'][key]['quantity'] = quantity
-        else:
-            self.cart['products'][key]['quantity'] = max(1, self.cart['products'][key]['quantity'] + quantity)
-        
+        price = self.cart['products'][key]['price'] if key in self.cart['products'] \
+            else str(self._get_price(perfume, capacity))
+        self.storage.add_product(key, perfume.id, capacity.id, price, quantity, override_quantity)
         self.save()
 
 
     def _get_price(self, perfume, capacity):
         try:
             perfume_capacity = PerfumeCapacity.objects.get(perfume=perfume, capacity=capacity)
-            return perfume_capacity.price if perfume_capacity.price else perfume.get_price_with_discount()
+            # Та же цена объёма со скидкой, что на карточке и в выборе объёма
+            return perfume_capacity.effective_price or perfume.get_price_with_discount()
         except PerfumeCapacity.DoesNotExist:
             return perfume.get_price_with_discount()
 
 
     def save(self):
-        self.session[settings.CART_SESSION_ID] = self.cart
-        self.session.modified = True
+        """Перечитывает корзину после изменения в хранилище"""
+        self.cart = self.storage.load()
+        self.modified = True
+        self._items = None
+        self._snapshot = None
 
 
     def remove(self, perfume, capacity):
         key = f"{perfume.id}_{capacity.id}"
         if key in self.cart['products']:
-            del self.cart['products'][key]
+            self.storage.remove_product(key)
             self.save()
 
 
     def get_total_price(self):
-        total = Decimal(0)
-        for item in self:
-            total += Decimal(item['price']) * item['quantity']
-        return total
+        return self.get_snapshot().subtotal
 
 
-    def __iter__(self):
-        for key, item_data in self.cart['products'].items():
-            try:
-                perfume = Perfume.objects.get(id=item_data['perfume_id'])
-                capacity = Capacity.objects.get(id=item_data['capacity_id'])
-                yield {
-                    'key': key,
-                    'perfume': perfume,
-                    'capacity': capacity,
-                    'quantity': item_data['quantity'],
-                    'price': Decimal(item_data['price']),
-                    'total_price': Decimal(item_data['price']) * item_data['quantity'],
-                    'type': 'product',
-                }
-            except (Perfume.DoesNotExist, Capacity.DoesNotExist):
-                continue
+    def get_snapshot(self):
+        """Итоги со скидкой промокода из сессии; пересчитываются после изменения корзины или скидки"""
+        discount = Decimal(self.session.get('discount_percentage', 0))
+        if self._snapshot is None or self._snapshot.discount != discount:
+            self._snapshot = CartSnapshot(self.get_items(), len(self), discount)
+        return self._snapshot
 
+
+    def get_items(self):
+        """Строки корзины; все объекты загружаются пачкой за постоянное число запросов"""
+        if self._items is None:
+            self._items = self._load_items()
+        return self._items
+
+
+    def _load_items(self):
         from samples.models import Sample
+        from gifts.models import Gift
+
+        products = self.cart['products']
+        perfume_ids = {item_data['perfume_id'] for item_data in products.values()}
+        capacity_ids = {item_data['capacity_id'] for item_data in products.values()}
+        perfumes = Perfume.objects.in_bulk(perfume_ids) if perfume_ids else {}
+        capacities = Capacity.objects.in_bulk(capacity_ids) if capacity_ids else {}
+        perfume_capacities = {
+            (perfume_capacity.perfume_id, perfume_capacity.capacity_id): perfume_capacity
+            for perfume_capacity in PerfumeCapacity.objects.filter(
+                perfume_id__in=perfume_ids, capacity_id__in=capacity_ids
+            )
+        } if perfume_ids else {}
+
+        items = []
+        for key, item_data in products.items():
+            perfume = perfumes.get(item_data['perfume_id'])
+            capacity = capacities.get(item_data['capacity_id'])
+            if perfume is None or capacity is None:
+                continue
+            items.append({
+                'key': key,
+                'perfume': perfume,
+                'capacity': capacity,
+                'perfume_capacity': perfume_capacities.get((perfume.id, capacity.id)),
+                'quantity': item_data['quantity'],
+                'price': Decimal(item_data['price']),
+                'total_price': Decimal(item_data['price']) * item_data['quantity'],
+                'type': 'product',
+            })
+
+        samples = Sample.objects.in_bulk([int(sample_id) for sample_id in self.cart['samples']]) \
+            if self.cart['samples'] else {}
         for sample_id in self.cart['samples']:
-            try:
-                sample = Sample.objects.get(id=sample_id)
-                yield {
-                    'key': f"sample_{sample_id}",
-                    'sample': sample,
-                    'quantity': 1,
-                    'price': Decimal(0),
-                    'total_price': Decimal(0),
-                    'type': 'sample',
-                }
-            except Sample.DoesNotExist:
+            sample = samples.get(int(sample_id))
+            if sample is None:
                 continue
-
-        from gifts.models import Gift
+            items.append({
+                'key': f"sample_{sample_id}",
+                'sample': sample,
+                'quantity': 1,
+                'price': Decimal(0),
+                'total_price': Decimal(0),
+                'type': 'sample',
+            })
+
+        gift = Gift.objects.filter(id=self.cart['gift_wrap']).first() if self.cart['gift_wrap'] else None
+        if gift is not None:
+            items.append({
+                'key': f"gift_{self.cart['gift_wrap']}",
+                'gift': gift,
+                'quantity': 1,
+                'price': Decimal(gift.price),
+                'total_price': Decimal(gift.price),
+                'type': 'gift',
+            })
+        return items
+
+
+    def item_keys(self):
+        """Ключи строк в порядке вывода; считаются по самой корзине, без запросов к базе"""
+        keys = list(self.cart['products'])
+        keys += [f"sample_{sample_id}" for sample_id in self.cart['samples']]
         if self.cart['gift_wrap']:
-            try:
-                gift = Gift.objects.get(id=self.cart['gift_wrap'])
-                yield {
-                    'key': f"gift_{self.cart['gift_wrap']}",
-                    'gift': gift,
-                    'quantity': 1,
-                    'price': Decimal(gift.price),
-                    'total_price': Decimal(gift.price),
-                    'type': 'gift',
-                }
-            except Gift.DoesNotExist:
-                pass
+            keys.append(f"gift_{self.cart['gift_wrap']}")
+        return keys
+
+
+    def __iter__(self):
+        return iter(self.get_items())
 
 
     def __len__(self):
@@ -116,62 +172,50 @@ class Cart:
 
 
     def clear(self):
-        self.cart = {
-            'products': {},
-            'samples': [],
-            'gift_wrap': None,
-            'special_instructions': ''
-        }
+        self.storage.clear()
         self.save()
     
 
     def update_quantity(self, perfume, capacity, quantity):
         key = f"{perfume.id}_{capacity.id}"
-        if key in self.cart['products']:  
-            self.cart['products'][key]['quantity'] = quantity
+        if key in self.cart['products']:
+            self.storage.set_quantity(key, quantity)
             self.save()
 
 
     def add_sample(self, sample_id):
-        sample_id = str(sample_id)  
-        if sample_id not in self.cart['samples'] and len(self.cart['samples']) < 2:
-            self.cart['samples'].append(sample_id)
-            self.save()
+        self.storage.add_sample(str(sample_id))
+        self.save()
 
 
     def replace_sample(self, sample_id):
-        sample_id = str(sample_id)
-        if sample_id not in self.cart['samples']:
-            if len(self.cart['samples']) >= 2:
-                self.cart['samples'].pop(0)  # Удаляем первый пробник
-            self.cart['samples'].append(sample_id)
-            self.save()
+        # При двух выбранных пробниках первый уступает место новому
+        self.storage.add_sample(str(sample_id), replace=True)
+        self.save()
 
 
     def remove_sample(self, sample_id):
-        sample_id = str(sample_id)  
-        if sample_id in self.cart['samples']:
-            self.cart['samples'].remove(sample_id)
-            self.save()
+        self.storage.remove_sample(str(sample_id))
+        self.save()
 
 
     def remove_all_samples(self):
-        self.cart['samples'] = []
+        self.storage.set('samples', [])
         self.save()
 
 
     def set_gift_wrap(self, gift_id):
-        self.cart['gift_wrap'] = gift_id
+        self.storage.set('gift_wrap', gift_id)
         self.save()
 
 
     def remove_gift_wrap(self):
-        self.cart['gift_wrap'] = None
+        self.storage.set('gift_wrap', None)
         self.save()
 
 
     def set_special_instructions(self, instructions):
-        self.cart['special_instructions'] = instructions
+        self.storage.set('special_instructions', instructions)
         self.save()
 
 
@@ -181,10 +225,4 @@ class Cart:
 
 
     def get_gift_wrap(self):
-        from gifts.models import Gift
-        if self.cart['gift_wrap']:
-            try:
-                return Gift.objects.get(id=self.cart['gift_wrap'])
-            except Gift.DoesNotExist:
-                return None
-        return None
\ No newline at end of file
+        return next((item['gift'] for item in self.get_items() if item['type'] == 'gift'), None)
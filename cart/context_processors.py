@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def cart_count_cookie(request):
+    # Имя куки со счётчиком корзины нужно скрипту в шапке
+    return {'cart_count_cookie': settings.CART_COUNT_COOKIE}
@@ -0,0 +1,30 @@
+from django.conf import settings
+
+from .cart import get_cart
+
+
+class CartCountCookieMiddleware:
+    """
+    После изменения корзины кладёт число товаров в куку: счётчик в шапке читается из неё скриптом,
+    поэтому страницам (в том числе закэшированным) не нужно обращаться к корзине.
+    После входа и выхода корзина сменилась целиком (см. cart.signals) — счётчик пересчитывается заново.
+    Корзина вошедшего пользователя хранится в базе дольше CART_TTL: когда кука истекла, она восстанавливается.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cart', None)
+        if getattr(request, '_cart_replaced', False):
+            cart = get_cart(request)
+        elif cart is None or not cart.modified:
+            cart = None
+            if settings.CART_COUNT_COOKIE not in request.COOKIES and request.user.is_authenticated:
+                cart = get_cart(request)
+        if cart is not None:
+            # Пустая корзина тоже пишется (0): отсутствие куки означает «счётчик неизвестен»
+            response.set_cookie(settings.CART_COUNT_COOKIE, len(cart), max_age=settings.CART_TTL, samesite='Lax')
+        return response
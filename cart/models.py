@@ -1,3 +1,46 @@
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+
+class StoredCart(models.Model):
+    """
+    Корзина в базе. У вошедшего пользователя привязана к нему и переживает смену устройства и сессии;
+    анонимная (при CART_STORAGE = DatabaseCartStorage) находится по токену из сессии.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='stored_cart')
+    token = models.CharField(max_length=32, unique=True, null=True, blank=True)
+    samples = ArrayField(models.CharField(max_length=20), default=list, blank=True)
+    gift_wrap = models.ForeignKey('gifts.Gift', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    special_instructions = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        indexes = [
+            # Для очистки брошенных анонимных корзин
+            models.Index(fields=['updated_at'], condition=Q(user__isnull=True), name='cart_anonymous_updated_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"Cart of {self.user}" if self.user_id else f"Anonymous cart {self.token}"
+
+
+class StoredCartLine(models.Model):
+    cart = models.ForeignKey(StoredCart, on_delete=models.CASCADE, related_name='lines')
+    perfume = models.ForeignKey('main.Perfume', on_delete=models.CASCADE, related_name='+')
+    capacity = models.ForeignKey('main.Capacity', on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+    class Meta:
+        unique_together = ('cart', 'perfume', 'capacity')
+
+
+    def __str__(self):
+        return f"{self.perfume_id}_{self.capacity_id} × {self.quantity}"
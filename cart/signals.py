@@ -0,0 +1,38 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from gifts.models import Gift
+from main.caching import bump_version, PICKERS
+from samples.models import Sample
+from .storage import merge_anonymous_cart
+
+
+def _replace_cart(request):
+    # Корзина запроса, если её уже прочитали, принадлежит прежнему владельцу
+    request.__dict__.pop('_cart', None)
+    request._cart_replaced = True
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    if request is None:
+        return
+    merge_anonymous_cart(request, user)
+    _replace_cart(request)
+
+
+@receiver(user_logged_out)
+def reset_cart_on_logout(sender, request, user, **kwargs):
+    if request is not None:
+        _replace_cart(request)
+
+
+@receiver(post_save, sender=Sample)
+@receiver(post_delete, sender=Sample)
+@receiver(post_save, sender=Gift)
+@receiver(post_delete, sender=Gift)
+def picker_changed(sender, instance, **kwargs):
+    # Списки выбора на странице корзины берутся из кэша по версии
+    transaction.on_commit(lambda: bump_version(PICKERS))
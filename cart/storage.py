@@ -0,0 +1,445 @@
+import json
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import StoredCart, StoredCartLine
+
+# Пробников в корзине не больше двух
+MAX_SAMPLES = 2
+
+
+def empty_cart():
+    return {
+        'products': {},
+        'samples': [],
+        'gift_wrap': None,
+        'special_instructions': ''
+    }
+
+
+class SessionCartStorage:
+    """
+    Корзина целиком в сессии: каждое изменение перезаписывает сессию.
+    Пустая корзина в сессию не пишется, пока в неё что-нибудь не положат.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        cart = self.session.get(settings.CART_SESSION_ID)
+        self.cart = cart if isinstance(cart, dict) else empty_cart()
+
+
+    def _save(self):
+        self.session[settings.CART_SESSION_ID] = self.cart
+        self.session.modified = True
+
+
+    def load(self):
+        return self.cart
+
+
+    def add_product(self, key, perfume_id, capacity_id, price, quantity, override):
+        product = self.cart['products'].setdefault(key, {
+            'quantity': 0,
+            'perfume_id': perfume_id,
+            'capacity_id': capacity_id,
+            'price': price,
+        })
+        product['quantity'] = quantity if override else max(1, product['quantity'] + quantity)
+        self._save()
+
+
+    def set_quantity(self, key, quantity):
+        if key in self.cart['products']:
+            self.cart['products'][key]['quantity'] = quantity
+            self._save()
+
+
+    def remove_product(self, key):
+        if self.cart['products'].pop(key, None) is not None:
+            self._save()
+
+
+    def add_sample(self, sample_id, replace=False):
+        samples = self.cart['samples']
+        if sample_id in samples:
+            return
+        if len(samples) >= MAX_SAMPLES:
+            if not replace:
+                return
+            samples.pop(0)
+        samples.append(sample_id)
+        self._save()
+
+
+    def remove_sample(self, sample_id):
+        if sample_id in self.cart['samples']:
+            self.cart['samples'].remove(sample_id)
+            self._save()
+
+
+    def set(self, field, value):
+        self.cart[field] = value
+        self._save()
+
+
+    def clear(self):
+        self.cart = empty_cart()
+        self._save()
+
+
+# Атомарные операции над хэшем корзины: два быстрых клика не перетирают изменения друг друга
+ADD_PRODUCT_SCRIPT = """
+local quantity
+if ARGV[5] == '1' then
+    quantity = tonumber(ARGV[4])
+    redis.call('HSET', KEYS[1], ARGV[1], quantity)
+else
+    quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[4])
+    if quantity < 1 then
+        redis.call('HSET', KEYS[1], ARGV[1], 1)
+    end
+end
+redis.call('HSETNX', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+"""
+
+SET_QUANTITY_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+"""
+
+SAMPLES_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], 'samples')
+local samples = raw and cjson.decode(raw) or {}
+local position = nil
+for index, value in ipairs(samples) do
+    if value == ARGV[2] then position = index end
+end
+if ARGV[1] == 'remove' then
+    if not position then return 0 end
+    table.remove(samples, position)
+else
+    if position then return 0 end
+    if #samples >= tonumber(ARGV[3]) then
+        if ARGV[1] ~= 'replace' then return 0 end
+        table.remove(samples, 1)
+    end
+    table.insert(samples, ARGV[2])
+end
+redis.call('HSET', KEYS[1], 'samples', #samples > 0 and cjson.encode(samples) or '[]')
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CART_REDIS_URL, decode_responses=True)
+    return _client
+
+
+class RedisCartStorage:
+    """
+    Корзина в хэше Redis: количество каждой строки — отдельное поле (qty:<ключ>), цена — price:<ключ>,
+    плюс samples (JSON), gift_wrap и special_instructions. В сессии хранится только id корзины,
+    поэтому клики по корзине больше не переписывают сессию. Ключ живёт CART_TTL с последнего изменения.
+    Id корзины (и с ним сессия) появляется только при первом изменении: чтение пустой корзины
+    не пишет ни в сессию, ни в Redis.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        self.redis = get_redis()
+        self.ttl = settings.CART_TTL
+        cart_id = self.session.get(settings.CART_SESSION_ID)
+        self.key = f'cart:{cart_id}' if isinstance(cart_id, str) else None
+        if isinstance(cart_id, dict):
+            self._import(cart_id)
+
+
+    def _ensure_key(self):
+        if self.key is None:
+            cart_id = self.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+            self.key = f'cart:{cart_id}'
+        return self.key
+
+
+    def _import(self, cart):
+        # Корзина, сохранённая в сессии до перехода на Redis
+        self._ensure_key()
+        fields = {}
+        for key, product in cart.get('products', {}).items():
+            fields[f'qty:{key}'] = product['quantity']
+            fields[f'price:{key}'] = product['price']
+        fields['samples'] = json.dumps([str(sample_id) for sample_id in cart.get('samples', [])])
+        if cart.get('gift_wrap'):
+            fields['gift_wrap'] = cart['gift_wrap']
+        if cart.get('special_instructions'):
+            fields['special_instructions'] = cart['special_instructions']
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key, mapping=fields)
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+
+    def load(self):
+        cart = empty_cart()
+        if self.key is None:
+            return cart
+        data = self.redis.hgetall(self.key)
+        for field, value in data.items():
+            if field.startswith('qty:'):
+                key = field[4:]
+                perfume_id, capacity_id = key.split('_')
+                cart['products'][key] = {
+                    'quantity': int(value),
+                    'perfume_id': int(perfume_id),
+                    'capacity_id': int(capacity_id),
+                    'price': data.get(f'price:{key}', '0'),
+                }
+        cart['samples'] = json.loads(data.get('samples', '[]'))
+        cart['gift_wrap'] = data.get('gift_wrap') or None
+        cart['special_instructions'] = data.get('special_instructions', '')
+        return cart
+
+
+    def add_product(self, key, perfume_id, capacity_id, price, quantity, override):
+        self.redis.eval(
+            ADD_PRODUCT_SCRIPT, 1, self._ensure_key(),
+            f'qty:{key}', f'price:{key}', price, quantity, int(override), self.ttl,
+        )
+
+
+    def set_quantity(self, key, quantity):
+        if self.key is not None:
+            self.redis.eval(SET_QUANTITY_SCRIPT, 1, self.key, f'qty:{key}', quantity, self.ttl)
+
+
+    def remove_product(self, key):
+        if self.key is not None:
+            self.redis.hdel(self.key, f'qty:{key}', f'price:{key}')
+
+
+    def add_sample(self, sample_id, replace=False):
+        self.redis.eval(
+            SAMPLES_SCRIPT, 1, self._ensure_key(), 'replace' if replace else 'add', sample_id, MAX_SAMPLES, self.ttl,
+        )
+
+
+    def remove_sample(self, sample_id):
+        if self.key is None:
+            return
+        self.redis.eval(SAMPLES_SCRIPT, 1, self.key, 'remove', sample_id, MAX_SAMPLES, self.ttl)
+
+
+    def set(self, field, value):
+        if self.key is None and value in (None, '', []):
+            return
+        pipe = self.redis.pipeline()
+        key = self._ensure_key()
+        if value in (None, ''):
+            pipe.hdel(key, field)
+        elif field == 'samples':
+            pipe.hset(key, field, json.dumps(value))
+        else:
+            pipe.hset(key, field, value)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+    def clear(self):
+        if self.key is not None:
+            self.redis.delete(self.key)
+
+
+class DatabaseCartStorage:
+    """
+    Корзина в StoredCart/StoredCartLine. Для вошедших пользователей используется всегда: корзина
+    привязана к пользователю, поэтому её можно очистить по владельцу заказа из вебхука оплаты.
+    Без user работает как анонимное хранилище с токеном в сессии.
+    """
+
+    def __init__(self, request=None, user=None):
+        self.session = request.session if request is not None else None
+        self.user = user
+        self._record = None
+
+
+    def _get(self, create=False):
+        if self._record is None:
+            if self.user is not None:
+                self._record = StoredCart.objects.filter(user=self.user).first()
+                if self._record is None and create:
+                    self._record, _ = StoredCart.objects.get_or_create(user=self.user)
+            else:
+                token = self.session.get(settings.CART_SESSION_ID)
+                if isinstance(token, str):
+                    self._record = StoredCart.objects.filter(token=token).first()
+                if self._record is None and create:
+                    token = self.session[settings.CART_SESSION_ID] = uuid.uuid4().hex
+                    self._record = StoredCart.objects.create(token=token)
+        return self._record
+
+
+    def _touch(self, record, **fields):
+        # updated_at определяет, когда анонимная корзина считается брошенной
+        StoredCart.objects.filter(pk=record.pk).update(updated_at=timezone.now(), **fields)
+
+
+    def load(self):
+        cart = empty_cart()
+        record = self._get()
+        if record is None:
+            return cart
+        for line in record.lines.order_by('pk'):
+            cart['products'][f'{line.perfume_id}_{line.capacity_id}'] = {
+                'quantity': line.quantity,
+                'perfume_id': line.perfume_id,
+                'capacity_id': line.capacity_id,
+                'price': str(line.price),
+            }
+        cart['samples'] = list(record.samples)
+        cart['gift_wrap'] = str(record.gift_wrap_id) if record.gift_wrap_id else None
+        cart['special_instructions'] = record.special_instructions
+        return cart
+
+
+    def add_product(self, key, perfume_id, capacity_id, price, quantity, override):
+        record = self._get(create=True)
+        lines = StoredCartLine.objects.filter(cart=record, perfume_id=perfume_id, capacity_id=capacity_id)
+        new_quantity = Value(quantity) if override else Greatest(F('quantity') + quantity, 1)
+        if not lines.update(quantity=new_quantity):
+            _, created = StoredCartLine.objects.get_or_create(
+                cart=record, perfume_id=perfume_id, capacity_id=capacity_id,
+                defaults={'quantity': quantity if override else max(1, quantity), 'price': price},
+            )
+            if not created:
+                # Строку между update() и вставкой создал параллельный запрос — применяем изменение к ней
+                lines.update(quantity=new_quantity)
+        self._touch(record)
+
+
+    def set_quantity(self, key, quantity):
+        record = self._get()
+        if record is not None:
+            perfume_id, capacity_id = key.split('_')
+            record.lines.filter(perfume_id=perfume_id, capacity_id=capacity_id).update(quantity=quantity)
+            self._touch(record)
+
+
+    def remove_product(self, key):
+        record = self._get()
+        if record is not None:
+            perfume_id, capacity_id = key.split('_')
+            record.lines.filter(perfume_id=perfume_id, capacity_id=capacity_id).delete()
+            self._touch(record)
+
+
+    def _update_samples(self, update):
+        record = self._get(create=True)
+        with transaction.atomic():
+            samples = StoredCart.objects.select_for_update().values_list('samples', flat=True).get(pk=record.pk)
+            samples = update(list(samples))
+            if samples is not None:
+                self._touch(record, samples=samples)
+        self._record = None
+
+
+    def add_sample(self, sample_id, replace=False):
+        def update(samples):
+            if sample_id in samples:
+                return None
+            if len(samples) >= MAX_SAMPLES:
+                if not replace:
+                    return None
+                samples.pop(0)
+            return samples + [sample_id]
+
+        self._update_samples(update)
+
+
+    def remove_sample(self, sample_id):
+        if self._get() is not None:
+            self._update_samples(lambda samples: [s for s in samples if s != sample_id] if sample_id in samples else None)
+
+
+    def set(self, field, value):
+        record = self._get(create=value not in (None, '', []))
+        if record is None:
+            return
+        if field == 'gift_wrap':
+            field, value = 'gift_wrap_id', value or None
+        elif value is None:
+            value = [] if field == 'samples' else ''
+        self._touch(record, **{field: value})
+        self._record = None
+
+
+    def clear(self):
+        record = self._get()
+        if record is not None:
+            record.delete()
+            self._record = None
+
+
+def get_anonymous_cart_storage(request):
+    return import_string(settings.CART_STORAGE)(request)
+
+
+def get_cart_storage(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return DatabaseCartStorage(request, user=user)
+    return get_anonymous_cart_storage(request)
+
+
+def clear_user_cart(user):
+    DatabaseCartStorage(user=user).clear()
+
+
+def merge_anonymous_cart(request, user):
+    """
+    Переносит анонимную корзину в корзину пользователя: количества одинаковых строк складываются,
+    пробники добавляются с вытеснением старых, упаковка и комментарий берутся из анонимной, если заданы.
+    """
+    from main.models import Perfume, Capacity
+    from gifts.models import Gift
+
+    anonymous = get_anonymous_cart_storage(request)
+    cart = anonymous.load()
+    if not (cart['products'] or cart['samples'] or cart['gift_wrap'] or cart['special_instructions']):
+        return False
+
+    target = DatabaseCartStorage(request, user=user)
+    products = cart['products'].values()
+    # Внешние ключи проверяются только при коммите — удалённые за это время товары отбрасываем заранее
+    perfume_ids = set(Perfume.objects.filter(pk__in=[p['perfume_id'] for p in products]).values_list('pk', flat=True))
+    capacity_ids = set(Capacity.objects.filter(pk__in=[p['capacity_id'] for p in products]).values_list('pk', flat=True))
+    for key, product in cart['products'].items():
+        if product['perfume_id'] in perfume_ids and product['capacity_id'] in capacity_ids:
+            target.add_product(
+                key, product['perfume_id'], product['capacity_id'], product['price'], product['quantity'], False,
+            )
+    for sample_id in cart['samples']:
+        target.add_sample(str(sample_id), replace=True)
+    if cart['gift_wrap'] and Gift.objects.filter(pk=cart['gift_wrap']).exists():
+        target.set('gift_wrap', cart['gift_wrap'])
+    if cart['special_instructions']:
+        target.set('special_instructions', cart['special_instructions'])
+
+    anonymous.clear()
+    request.session.pop(settings.CART_SESSION_ID, None)
+    return True
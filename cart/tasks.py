@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import StoredCart, StoredCartLine
+
+# Корзин за одну транзакцию: короткие транзакции не держат блокировки и не раздувают WAL
+PURGE_BATCH_SIZE = 500
+
+
+@shared_task
+def purge_expired_carts():
+    """
+    Удаляет анонимные корзины, не менявшиеся дольше CART_TTL. Корзины пользователей не истекают.
+    Заблокированные прямо сейчас (в них что-то кладут) пропускаются до следующего запуска.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.CART_TTL)
+    purged = 0
+    while True:
+        with transaction.atomic():
+            cart_ids = list(
+                StoredCart.objects.select_for_update(skip_locked=True)
+                .filter(user__isnull=True, updated_at__lt=cutoff)
+                .values_list('pk', flat=True)[:PURGE_BATCH_SIZE]
+            )
+            if not cart_ids:
+                return purged
+            StoredCartLine.objects.filter(cart_id__in=cart_ids).delete()
+            StoredCart.objects.filter(pk__in=cart_ids).delete()
+        purged += len(cart_ids)
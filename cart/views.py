@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
-from .cart import Cart
+from .cart import get_cart
+from .storage import MAX_SAMPLES
+from main.caching import get_version, PICKERS
 from main.models import Perfume, PerfumeCapacity, Capacity
 from promo.models import PromoCode
 from promo.forms import PromoCodeForm
@@ -11,11 +12,87 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Шаблон строки корзины и префикс её id: на странице корзины и в модальном окне
+LINE_TEMPLATES = {
+    False: ('cart/partials/cart_item.html', 'cart-item-'),
+    True: ('cart/partials/cart_modal_item.html', 'cart-modal-item-'),
+}
+
+# Списки пробников и упаковок одинаковы для всех; версия PICKERS меняется при их правке
+PICKER_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _summary_context(request, cart, promo_message=None):
+    snapshot = cart.get_snapshot()
+    return {
+        'cart': cart,
+        'total_price': snapshot.subtotal,
+        'discounted_price': snapshot.discounted_total,
+        'discount': snapshot.discount,
+        'promo_form': PromoCodeForm(),
+        'promo_message': request.session.get('promo_message', '') if promo_message is None else promo_message,
+    }
+
+
+def _modal_context(request, cart, promo_message=None):
+    return {
+        **_summary_context(request, cart, promo_message),
+        'gift_wrap': cart.get_gift_wrap(),
+        'special_instructions': cart.cart.get('special_instructions', ''),
+    }
+
+
+def _cart_state(cart):
+    """Выбор в списках пробников и упаковок; отмечается скриптом страницы корзины"""
+    return {
+        'samples': [str(sample_id) for sample_id in cart.cart['samples']],
+        'gift_wrap': str(cart.cart['gift_wrap']) if cart.cart['gift_wrap'] else None,
+        'has_products': bool(cart.cart['products']),
+        'max_samples': MAX_SAMPLES,
+    }
+
+
+def _cart_delta(request, cart, before, line_key=None, error=None):
+    """
+    Ответ HTMX на изменение корзины: только строка line_key, на которую нацелена форма, а остальные
+    изменившиеся строки, итоги, счётчик пробников и выбор в списках — внеполосными (hx-swap-oob) вставками.
+    before — ключи строк до изменения. Если корзина опустела или наполнилась, список перерисовывается целиком.
+    """
+    is_modal = request.POST.get('is_modal') == 'true'
+    line_template, line_prefix = LINE_TEMPLATES[is_modal]
+    items = {item['key']: item for item in cart.get_items()}
+    after = list(items)
+    context = {
+        **_modal_context(request, cart, error),
+        'cart_state': _cart_state(cart),
+        'is_modal': is_modal,
+        'line_template': line_template,
+        'line_prefix': line_prefix,
+        'error': error,
+    }
+
+    if not before or not after or after[0] not in before:
+        context['full'] = 'cart/partials/cart_modal.html' if is_modal else 'cart/partials/cart_items.html'
+        response = render(request, 'cart/partials/cart_delta.html', context)
+        response['HX-Retarget'] = '#cartModalContent' if is_modal else '#cart-items-container'
+        response['HX-Reswap'] = 'innerHTML'
+        return response
+
+    context['line'] = items.get(line_key)
+    context['removed'] = [key for key in before if key not in items and key != line_key]
+    # Новая строка встаёт после предыдущей: та уже была на странице или вставлена раньше в этом же ответе
+    context['added'] = [
+        (after[index - 1], items[key]) for index, key in enumerate(after) if key not in before and key != line_key
+    ]
+    return render(request, 'cart/partials/cart_delta.html', context)
+
+
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     promo_form = PromoCodeForm()
     discount = Decimal(0)
     promo_message = ""
+    # Запросы выполнятся, только если списков нет в кэше
     samples = Sample.objects.filter(available=True)
     gifts = Gift.objects.filter(available=True)
     special_instructions = cart.cart.get('special_instructions', '')
@@ -44,58 +121,45 @@ def cart_detail(request):
             'cart': cart,
             'promo_form': promo_form,
             'discount': discount,
-            'total_price': cart.get_total_price(),
-            'discounted_price': cart.get_total_price() * (Decimal(1) - discount / Decimal(100)),
+            'total_price': cart.get_snapshot().subtotal,
+            'discounted_price': cart.get_snapshot().subtotal * (Decimal(1) - discount / Decimal(100)),
             'promo_message': promo_message,
         })
 
-    total_price = cart.get_total_price()
-    discount = Decimal(request.session.get('discount_percentage', 0))
-    discounted_price = total_price * (Decimal(1) - discount / Decimal(100))
-
-    logger.debug(f"Cart detail: total_price={total_price}, discounted_price={discounted_price}, discount={discount}")
+    snapshot = cart.get_snapshot()
+    logger.debug(f"Cart detail: total_price={snapshot.subtotal}, discounted_price={snapshot.discounted_total}, discount={snapshot.discount}")
 
     return render(request, 'cart/cart_detail.html', {
         'cart': cart,
         'promo_form': promo_form,
-        'discount': discount,
-        'total_price': total_price,
-        'discounted_price': discounted_price,
+        'discount': snapshot.discount,
+        'total_price': snapshot.subtotal,
+        'discounted_price': snapshot.discounted_total,
         'promo_message': promo_message,
         'samples': samples,
         'gifts': gifts,
+        'picker_cache_timeout': PICKER_CACHE_TIMEOUT,
+        'pickers_version': get_version(PICKERS),
+        'cart_state': _cart_state(cart),
         'gift_wrap': cart.get_gift_wrap(),
         'special_instructions': special_instructions,
     })
 
 def sample_counter(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     logger.debug(f"Rendering sample counter: samples={cart.cart['samples']}")
     return render(request, 'cart/partials/sample_counter.html', {
         'cart': cart,
     })
 
 def cart_summary(request):
-    cart = Cart(request)
-    total_price = cart.get_total_price()
-    discount = Decimal(request.session.get('discount_percentage', 0))
-    discounted_price = total_price * (Decimal(1) - discount / Decimal(100))
-    promo_form = PromoCodeForm()
-    promo_message = request.session.get('promo_message', '')
-
-    logger.debug(f"Rendering cart summary: total_price={total_price}, discounted_price={discounted_price}, discount={discount}")
-
-    return render(request, 'cart/partials/cart_summary.html', {
-        'cart': cart,
-        'total_price': total_price,
-        'discounted_price': discounted_price,
-        'discount': discount,
-        'promo_form': promo_form,
-        'promo_message': promo_message,
-    })
+    cart = get_cart(request)
+    context = _summary_context(request, cart)
+    logger.debug(f"Rendering cart summary: total_price={context['total_price']}, discounted_price={context['discounted_price']}, discount={context['discount']}")
+    return render(request, 'cart/partials/cart_summary.html', context)
 
 def cart_items(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     logger.debug(f"Rendering cart items: items={len(cart.cart['products'])}, samples={len(cart.cart['samples'])}, gift_wrap={cart.cart['gift_wrap']}")
     return render(request, 'cart/partials/cart_items.html', {
         'cart': cart,
@@ -103,7 +167,7 @@ def cart_items(request):
 
 def cart_add(request, perfume_id):
     if request.method == 'POST':
-        cart = Cart(request)
+        cart = get_cart(request)
         perfume = get_object_or_404(Perfume, id=perfume_id)
         capacity_id = request.POST.get('capacity')
         quantity = int(request.POST.get('quantity', 1))
@@ -124,22 +188,24 @@ def cart_add(request, perfume_id):
             logger.error(f"Error accessing capacity or perfume_capacity: {e}")
             return redirect('main:perfume_detail', slug=perfume.slug)
 
+        before = cart.item_keys()
         cart.add(perfume, capacity, quantity, override_quantity=override)
         logger.info(f"Added to cart: perfume_id={perfume_id}, capacity_id={capacity_id}, quantity={quantity}")
         
         if request.headers.get('HX-Request') == 'true':
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
+            # Окно корзины ещё не загружалось — рисуем его целиком
+            if request.POST.get('modal_loaded') != 'true':
+                return render(request, 'cart/partials/cart_modal.html', _modal_context(request, cart))
+            key = f"{perfume.id}_{capacity.id}"
+            if key not in before:
+                # Новая строка придёт внеполосной вставкой после предыдущей
+                response = _cart_delta(request, cart, before)
+                response.headers.setdefault('HX-Reswap', 'none')
+                return response
+            response = _cart_delta(request, cart, before, line_key=key)
+            response.headers.setdefault('HX-Retarget', f'#cart-modal-item-{key}')
+            response.headers.setdefault('HX-Reswap', 'outerHTML')
+            return response
         
         response = redirect('main:perfume_detail', slug=perfume.slug)
         response.set_cookie('show_cart_modal', 'true')
@@ -148,9 +214,10 @@ def cart_add(request, perfume_id):
     return redirect('main:home')
 
 def cart_remove(request, perfume_id, capacity_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     perfume = get_object_or_404(Perfume, id=perfume_id)
     capacity = get_object_or_404(Capacity, id=capacity_id)
+    before = cart.item_keys()
     
     cart.remove(perfume, capacity)
     cart.remove_all_samples()
@@ -158,29 +225,7 @@ def cart_remove(request, perfume_id, capacity_id):
     logger.info(f"Removed from cart: perfume_id={perfume_id}, capacity_id={capacity_id}, cleared samples and gift")
 
     if request.headers.get('HX-Request') == 'true':
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
+        return _cart_delta(request, cart, before, line_key=f"{perfume_id}_{capacity_id}")
         
     referer = request.META.get('HTTP_REFERER')
     if referer:
@@ -189,117 +234,38 @@ def cart_remove(request, perfume_id, capacity_id):
 
 def cart_update_quantity(request, perfume_id, capacity_id):
     if request.method == 'POST':
-        cart = Cart(request)
+        cart = get_cart(request)
         perfume = get_object_or_404(Perfume, id=perfume_id)
         capacity = get_object_or_404(Capacity, id=capacity_id)
         quantity = int(request.POST.get('quantity', 1))
+        key = f"{perfume_id}_{capacity_id}"
+        before = cart.item_keys()
 
         try:
             perfume_capacity = PerfumeCapacity.objects.get(perfume=perfume, capacity=capacity)
             if not perfume_capacity.available or perfume_capacity.quantity < quantity:
                 logger.warning(f"Quantity not available: perfume_id={perfume_id}, capacity_id={capacity_id}, requested={quantity}")
-                is_modal = request.POST.get('is_modal') == 'true'
-                if is_modal:
-                    return render(request, 'cart/partials/cart_modal.html', {
-                        'cart': cart,
-                        'total_price': cart.get_total_price(),
-                        'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                        'discount': Decimal(request.session.get('discount_percentage', 0)),
-                        'promo_form': PromoCodeForm(),
-                        'promo_message': 'Requested quantity not available',
-                        'samples': Sample.objects.filter(available=True),
-                        'gifts': Gift.objects.filter(available=True),
-                        'gift_wrap': cart.get_gift_wrap(),
-                        'special_instructions': cart.cart.get('special_instructions', ''),
-                    })
-                else:
-                    return render(request, 'cart/partials/cart_item.html', {
-                        'item': next(item for item in cart if item['type'] == 'product' and item['perfume'].id == perfume_id and item['capacity'].id == capacity_id),
-                        'error': 'Requested quantity not available'
-                    })
+                return _cart_delta(request, cart, before, line_key=key, error='Requested quantity not available')
         except PerfumeCapacity.DoesNotExist:
             logger.error(f"PerfumeCapacity not found: perfume_id={perfume_id}, capacity_id={capacity_id}")
-            is_modal = request.POST.get('is_modal') == 'true'
-            if is_modal:
-                return render(request, 'cart/partials/cart_modal.html', {
-                    'cart': cart,
-                    'total_price': cart.get_total_price(),
-                    'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                    'discount': Decimal(request.session.get('discount_percentage', 0)),
-                    'promo_form': PromoCodeForm(),
-                    'promo_message': 'Capacity not found',
-                    'samples': Sample.objects.filter(available=True),
-                    'gifts': Gift.objects.filter(available=True),
-                    'gift_wrap': cart.get_gift_wrap(),
-                    'special_instructions': cart.cart.get('special_instructions', ''),
-                })
-            else:
-                return render(request, 'cart/partials/cart_item.html', {
-                    'item': next(item for item in cart if item['type'] == 'product' and item['perfume'].id == perfume_id and item['capacity'].id == capacity_id),
-                    'error': 'Capacity not found'
-                })
+            return _cart_delta(request, cart, before, line_key=key, error='Capacity not found')
 
         cart.add(perfume, capacity, quantity, override_quantity=True)
         logger.info(f"Updated quantity: perfume_id={perfume_id}, capacity_id={capacity_id}, quantity={quantity}")
 
         if request.headers.get('HX-Request') == 'true':
-            is_modal = request.POST.get('is_modal') == 'true'
-            if is_modal:
-                return render(request, 'cart/partials/cart_modal.html', {
-                    'cart': cart,
-                    'total_price': cart.get_total_price(),
-                    'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                    'discount': Decimal(request.session.get('discount_percentage', 0)),
-                    'promo_form': PromoCodeForm(),
-                    'promo_message': request.session.get('promo_message', ''),
-                    'samples': Sample.objects.filter(available=True),
-                    'gifts': Gift.objects.filter(available=True),
-                    'gift_wrap': cart.get_gift_wrap(),
-                    'special_instructions': cart.cart.get('special_instructions', ''),
-                })
-            else:
-                return HttpResponse(
-                    headers={
-                        'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                    },
-                    content=render(request, 'cart/partials/cart_item.html', {
-                        'item': next(item for item in cart if item['type'] == 'product' and item['perfume'].id == perfume_id and item['capacity'].id == capacity_id)
-                    }).content
-                )
+            return _cart_delta(request, cart, before, line_key=key)
     
     return redirect(request.META.get('HTTP_REFERER', 'main:home'))
 
 def cart_add_sample(request, sample_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     sample = get_object_or_404(Sample, id=sample_id)
+    before = cart.item_keys()
     
     if not cart.cart['products']:
         logger.info(f"Cannot add sample: sample_id={sample_id}, no items in cart")
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': 'Cannot add sample: cart is empty',
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
-    
-    if str(sample_id) in cart.cart['samples']:
+    elif str(sample_id) in cart.cart['samples']:
         cart.remove_sample(sample_id)
         logger.info(f"Removed sample: sample_id={sample_id}")
     else:
@@ -307,95 +273,29 @@ def cart_add_sample(request, sample_id):
         logger.info(f"Added sample: sample_id={sample_id}")
 
     if request.headers.get('HX-Request') == 'true':
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
+        return _cart_delta(request, cart, before)
     
     return redirect('cart:cart_detail')
 
 def cart_remove_sample(request, sample_id):
-    cart = Cart(request)
+    cart = get_cart(request)
+    before = cart.item_keys()
     cart.remove_sample(sample_id)
     logger.info(f"Removed sample: sample_id={sample_id}")
     
     if request.headers.get('HX-Request') == 'true':
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
+        return _cart_delta(request, cart, before, line_key=f"sample_{sample_id}")
         
     return redirect(request.META.get('HTTP_REFERER', 'cart:cart_detail'))
 
 def cart_add_gift(request, gift_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     gift = get_object_or_404(Gift, id=gift_id)
+    before = cart.item_keys()
     
     if not cart.cart['products']:
         logger.info(f"Cannot add gift: gift_id={gift_id}, no items in cart")
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': 'Cannot add gift: cart is empty',
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
-    
-    if cart.cart['gift_wrap'] == str(gift_id):
+    elif cart.cart['gift_wrap'] == str(gift_id):
         cart.remove_gift_wrap()
         logger.info(f"Removed gift wrap: gift_id={gift_id}")
     else:
@@ -403,78 +303,22 @@ def cart_add_gift(request, gift_id):
         logger.info(f"Added gift wrap: gift_id={gift_id}")
 
     if request.headers.get('HX-Request') == 'true':
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
+        return _cart_delta(request, cart, before)
     
     return redirect('cart:cart_detail')
 
 def cart_remove_gift(request):
-    cart = Cart(request)
+    cart = get_cart(request)
+    before = cart.item_keys()
+    gift_key = f"gift_{cart.cart['gift_wrap']}" if cart.cart['gift_wrap'] else None
     cart.remove_gift_wrap()
     logger.info("Removed gift wrap")
 
     if request.headers.get('HX-Request') == 'true':
-        is_modal = request.POST.get('is_modal') == 'true'
-        if is_modal:
-            return render(request, 'cart/partials/cart_modal.html', {
-                'cart': cart,
-                'total_price': cart.get_total_price(),
-                'discounted_price': cart.get_total_price() * (Decimal(1) - Decimal(request.session.get('discount_percentage', 0)) / Decimal(100)),
-                'discount': Decimal(request.session.get('discount_percentage', 0)),
-                'promo_form': PromoCodeForm(),
-                'promo_message': request.session.get('promo_message', ''),
-                'samples': Sample.objects.filter(available=True),
-                'gifts': Gift.objects.filter(available=True),
-                'gift_wrap': cart.get_gift_wrap(),
-                'special_instructions': cart.cart.get('special_instructions', ''),
-            })
-        else:
-            return HttpResponse(
-                headers={
-                    'HX-Trigger': '{"updateCartItems": "", "updateSampleCounter": "", "updateCartSummary": ""}',
-                },
-                content=render(request, 'cart/partials/cart_items.html', {
-                    'cart': cart,
-                }).content
-            )
+        return _cart_delta(request, cart, before, line_key=gift_key)
         
     return redirect(request.META.get('HTTP_REFERER', 'cart:cart_detail'))
 
 def cart_modal(request):
-    cart = Cart(request)
-    total_price = cart.get_total_price()
-    discount = Decimal(request.session.get('discount_percentage', 0))
-    discounted_price = total_price * (Decimal(1) - discount / Decimal(100))
-    return render(request, 'cart/partials/cart_modal.html', {
-        'cart': cart,
-        'total_price': total_price,
-        'discounted_price': discounted_price,
-        'discount': discount,
-        'promo_form': PromoCodeForm(),
-        'promo_message': request.session.get('promo_message', ''),
-        'samples': Sample.objects.filter(available=True),
-        'gifts': Gift.objects.filter(available=True),
-        'gift_wrap': cart.get_gift_wrap(),
-        'special_instructions': cart.cart.get('special_instructions', ''),
-    })
\ No newline at end of file
+    cart = get_cart(request)
+    return render(request, 'cart/partials/cart_modal.html', _modal_context(request, cart))
@@ -0,0 +1,34 @@
+from django.contrib import admin
+from .models import StockReservation, StockMovement
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+    # Удалённая активная бронь не вернула бы остаток
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(ReadOnlyAdmin):
+    list_display = ('order', 'perfume_capacity', 'quantity', 'status', 'expires_at', 'created_at')
+    list_filter = ('status',)
+    list_select_related = ('perfume_capacity__perfume', 'perfume_capacity__capacity')
+    raw_id_fields = ('order', 'perfume_capacity')
+    search_fields = ('order__id', 'perfume_capacity__perfume__name')
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(ReadOnlyAdmin):
+    list_display = ('perfume_capacity', 'delta', 'balance', 'reason', 'order', 'created_at')
+    list_filter = ('reason',)
+    list_select_related = ('perfume_capacity__perfume', 'perfume_capacity__capacity')
+    raw_id_fields = ('order', 'perfume_capacity')
+    search_fields = ('order__id', 'perfume_capacity__perfume__name')
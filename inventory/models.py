@@ -0,0 +1,60 @@
+from django.db import models
+from django.db.models import Q
+from main.models import PerfumeCapacity
+from orders.models import Order
+
+
+class StockReservation(models.Model):
+    """
+    Остаток, списанный под неоплаченный заказ. Активная бронь либо подтверждается оплатой,
+    либо возвращает остаток при отмене или по истечении expires_at.
+    """
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    )
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    perfume_capacity = models.ForeignKey(PerfumeCapacity, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        indexes = [
+            # Для снятия просроченных броней: в индексе только активные
+            models.Index(fields=['expires_at'], condition=Q(status='active'), name='reservation_active_expiry_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.perfume_capacity_id} × {self.quantity} for order {self.order_id} ({self.status})"
+
+
+class StockMovement(models.Model):
+    """Журнал изменений остатка: каждое списание и возврат с остатком после него"""
+    REASON_CHOICES = (
+        ('reserve', 'Reserved for order'),
+        ('release', 'Released on cancel'),
+        ('expire', 'Released on expiry'),
+    )
+
+    perfume_capacity = models.ForeignKey(PerfumeCapacity, on_delete=models.CASCADE, related_name='stock_movements')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    delta = models.IntegerField()
+    balance = models.PositiveIntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+    class Meta:
+        indexes = [models.Index(fields=['perfume_capacity', 'created_at'], name='stock_movement_history_idx')]
+
+
+    def __str__(self):
+        return f"{self.perfume_capacity_id} {self.delta:+d} → {self.balance} ({self.reason})"
@@ -0,0 +1,162 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from main.models import PerfumeCapacity
+from main.signals import catalog_changed
+from .models import StockReservation, StockMovement
+
+logger = logging.getLogger(__name__)
+
+# Броней за одну транзакцию при снятии просроченных
+EXPIRE_BATCH_SIZE = 100
+
+
+class InsufficientStock(Exception):
+    def __init__(self, perfume_capacity_id, requested):
+        super().__init__(f"Not enough stock for perfume capacity {perfume_capacity_id}: requested {requested}")
+        self.perfume_capacity_id = perfume_capacity_id
+        self.requested = requested
+
+
+def _change_stock(perfume_capacity_id, delta):
+    """
+    Меняет остаток одним UPDATE и возвращает новый остаток. Списание условное: если остатка
+    не хватает или объём снят с продажи, строка не меняется и возвращается None.
+    Блокируется только эта строка и только до конца транзакции.
+    """
+    sql = f'UPDATE {PerfumeCapacity._meta.db_table} SET quantity = quantity + %s, updated_at = %s WHERE id = %s'
+    params = [delta, timezone.now(), perfume_capacity_id]
+    if delta < 0:
+        sql += ' AND available AND quantity >= %s'
+        params.append(-delta)
+    with connection.cursor() as cursor:
+        cursor.execute(sql + ' RETURNING quantity, perfume_id', params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    balance, perfume_id = row
+    # Карточки и страницы показывают только «в наличии», поэтому каталог обновляется лишь на переходе через ноль
+    if balance == 0 or balance == delta:
+        catalog_changed([perfume_id])
+    return balance
+
+
+def _reserve(order, perfume_capacity_id, quantity):
+    balance = _change_stock(perfume_capacity_id, -quantity)
+    if balance is None:
+        raise InsufficientStock(perfume_capacity_id, quantity)
+    StockMovement.objects.create(
+        perfume_capacity_id=perfume_capacity_id, order=order, delta=-quantity, balance=balance, reason='reserve',
+    )
+
+
+def reserve_order(order):
+    """
+    Списывает остаток под все товары заказа и создаёт брони на RESERVATION_TTL.
+    Если хоть одного товара не хватает, бросает InsufficientStock и откатывает всё списанное.
+    """
+    items = list(order.items.values_list('perfume_id', 'capacity_id', 'quantity'))
+    capacity_ids = dict(
+        ((perfume_id, capacity_id), pk) for pk, perfume_id, capacity_id in PerfumeCapacity.objects.filter(
+            perfume_id__in=[item[0] for item in items]
+        ).values_list('pk', 'perfume_id', 'capacity_id')
+    )
+    quantities = {}
+    for perfume_id, capacity_id, quantity in items:
+        if (perfume_id, capacity_id) not in capacity_ids:
+            raise InsufficientStock(None, quantity)
+        pk = capacity_ids[perfume_id, capacity_id]
+        quantities[pk] = quantities.get(pk, 0) + quantity
+
+    expires_at = timezone.now() + timedelta(seconds=settings.RESERVATION_TTL)
+    with transaction.atomic():
+        # Строки блокируются в одном порядке — два заказа с общими товарами не взаимоблокируются
+        for pk in sorted(quantities):
+            _reserve(order, pk, quantities[pk])
+        StockReservation.objects.bulk_create([
+            StockReservation(order=order, perfume_capacity_id=pk, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in sorted(quantities.items())
+        ])
+
+
+def _return_stock(reservations, status, reason):
+    for reservation in reservations:
+        # Бронь возвращает остаток один раз, даже если отмену и истечение обрабатывают одновременно
+        if not StockReservation.objects.filter(pk=reservation.pk, status='active').update(
+            status=status, updated_at=timezone.now()
+        ):
+            continue
+        balance = _change_stock(reservation.perfume_capacity_id, reservation.quantity)
+        StockMovement.objects.create(
+            perfume_capacity_id=reservation.perfume_capacity_id, order_id=reservation.order_id,
+            delta=reservation.quantity, balance=balance, reason=reason,
+        )
+
+
+def release_order(order):
+    """Возвращает остаток по активным броням отменённого заказа"""
+    with transaction.atomic():
+        _return_stock(
+            sorted(order.reservations.filter(status='active'), key=lambda r: r.perfume_capacity_id),
+            'released', 'release',
+        )
+
+
+def reservation_expires_at(order):
+    """Когда истекает первая из активных броней заказа; платёж не должен жить дольше неё"""
+    return min(order.reservations.filter(status='active').values_list('expires_at', flat=True), default=None)
+
+
+def commit_order(order, require_all=False):
+    """
+    Подтверждает брони оплаченного заказа. Если бронь успела истечь или была снята,
+    остаток списывается заново; когда его уже нет, заказ оплачен сверх остатка — это пишется в лог.
+    require_all=True — при нехватке не подтверждается ничего и возвращается False:
+    двухстадийный платёж тогда отменяется, а не списывается.
+    """
+    try:
+        with transaction.atomic():
+            order.reservations.filter(status='active').update(status='committed', updated_at=timezone.now())
+            lapsed = order.reservations.filter(status__in=('released', 'expired')).order_by('perfume_capacity_id')
+            for reservation in lapsed:
+                try:
+                    with transaction.atomic():
+                        _reserve(order, reservation.perfume_capacity_id, reservation.quantity)
+                except InsufficientStock:
+                    if require_all:
+                        raise
+                    logger.error(
+                        f"Order {order.id} paid after its reservation lapsed and stock ran out: "
+                        f"perfume_capacity_id={reservation.perfume_capacity_id}, quantity={reservation.quantity}"
+                    )
+                    continue
+                StockReservation.objects.filter(pk=reservation.pk).update(
+                    status='committed', updated_at=timezone.now()
+                )
+    except InsufficientStock as e:
+        logger.warning(f"Order {order.id} cannot be committed, {e}")
+        return False
+    return True
+
+
+def release_expired_reservations():
+    """
+    Снимает просроченные брони короткими транзакциями. Брони, которые в этот момент
+    подтверждает или отменяет другой процесс, пропускаются и не ждут блокировки.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            reservations = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status='active', expires_at__lt=timezone.now())
+                .order_by('perfume_capacity_id')[:EXPIRE_BATCH_SIZE]
+            )
+            if not reservations:
+                return released
+            _return_stock(reservations, 'expired', 'expire')
+        released += len(reservations)
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from .stock import release_expired_reservations
+
+
+@shared_task
+def expire_reservations():
+    return release_expired_reservations()
@@ -1,15 +1,32 @@
 from django.contrib import admin
 from django import forms
-from .models import Capacity, Category, Perfume, PerfumeCapacity, PerfumeImage, \
+from django.urls import reverse
+from django.utils.html import format_html
+from .models import Capacity, Category, Perfume, PerfumeCapacity, PerfumeImage, ImageBatchJob, \
     OlfactoryNote, OlfactoryNoteCategory, OlfactoryFamily, Ingredient
 from adminsortable2.admin import SortableAdminMixin
+from .images import resume_image_batch, start_image_batch
+from .tasks import enqueue_image_batch
 
 
 @admin.action(description='Сжать выбранные изображения')
 def compress_selected_images(modeladmin, request, queryset):
-    for image in queryset:
-        image.save()
-    modeladmin.message_user(request, "Изображения успешно сжаты.")
+    job = start_image_batch(queryset)
+    enqueue_image_batch(job)
+    url = reverse('admin:main_imagebatchjob_change', args=[job.pk])
+    modeladmin.message_user(request, format_html(
+        'Изображений поставлено в очередь на сжатие: {}. Прогресс: <a href="{}">пакет #{}</a>.', job.total, url, job.pk
+    ))
+
+
+@admin.action(description='Возобновить выбранные пакеты')
+def resume_image_batches(modeladmin, request, queryset):
+    count = 0
+    for job in queryset:
+        image_ids = resume_image_batch(job)
+        enqueue_image_batch(job, image_ids)
+        count += len(image_ids)
+    modeladmin.message_user(request, f"Изображений возвращено в очередь: {count}.")
 
 
 class PerfumeAdminForm(forms.ModelForm):
@@ -35,6 +52,7 @@ class PerfumeCapacityInline(admin.TabularInline):
 class PerfumeImageInline(admin.TabularInline):
     model = PerfumeImage
     extra = 5
+    readonly_fields = ('status',)
 
 
 class IngredientInline(admin.TabularInline):
@@ -70,7 +88,7 @@ class OlfactoryFamilyAdmin(admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'slug', 'parent', 'show_in_filters', 'show_in_fragrances', 'filter_name', 'description')
+    list_display = ('name', 'slug', 'parent', 'item_count', 'show_in_filters', 'show_in_fragrances', 'filter_name', 'description')
     list_editable = ('show_in_filters', 'show_in_fragrances', 'filter_name')
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ('name', 'description')
@@ -78,6 +96,15 @@ class CategoryAdmin(admin.ModelAdmin):
     ordering = ('name',)
 
 
+    def get_queryset(self, request):
+        return Category.with_item_counts(super().get_queryset(request))
+
+
+    @admin.display(description='Items', ordering='item_count')
+    def item_count(self, obj):
+        return obj.item_count
+
+
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'olfactory_family', 'show_in_fragrances')
@@ -104,5 +131,30 @@ class PerfumeAdmin(SortableAdminMixin, admin.ModelAdmin):
 
 @admin.register(PerfumeImage)
 class PerfumeImageAdmin(admin.ModelAdmin):
-    list_display = ('product', 'image')
-    actions = [compress_selected_images]
\ No newline at end of file
+    list_display = ('product', 'image', 'status')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'processing_error')
+    actions = [compress_selected_images]
+
+
+@admin.register(ImageBatchJob)
+class ImageBatchJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress', 'total', 'processed', 'failed', 'created_at', 'updated_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'progress', 'total', 'processed', 'failed', 'image_ids',
+                       'created_at', 'updated_at', 'finished_at')
+    actions = [resume_image_batches]
+
+
+    def has_add_permission(self, request):
+        return False
+
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+    @admin.display(description='Progress')
+    def progress(self, obj):
+        done = obj.processed + obj.failed
+        return f"{done * 100 // obj.total if obj.total else 100}%"
@@ -0,0 +1,166 @@
+import threading
+from bisect import bisect_left, insort
+from urllib.parse import urlencode
+
+from django.urls import reverse
+
+from .caching import get_version, AUTOCOMPLETE
+from .models import Perfume, OlfactoryNote, OlfactoryFamily, Ingredient, Category
+from .search import normalize_query
+
+# Порядок типов в выдаче
+KINDS = ('perfume', 'category', 'olfactory_family', 'ingredient', 'note')
+
+SUGGESTION_LIMIT = 8
+
+
+def _perfume_rows(ids=None):
+    queryset = Perfume.objects.filter(available=True)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return [
+        (pk, name, reverse('main:perfume_detail', args=[slug]))
+        for pk, name, slug in queryset.values_list('pk', 'name', 'slug')
+    ]
+
+
+def _catalog_url(**params):
+    return f"{reverse('main:catalog')}?{urlencode(params)}"
+
+
+def _category_rows(ids=None):
+    queryset = Category.objects.filter(show_in_fragrances=True)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return [(pk, name, _catalog_url(category=slug)) for pk, name, slug in queryset.values_list('pk', 'name', 'slug')]
+
+
+def _family_rows(ids=None):
+    queryset = OlfactoryFamily.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return [(pk, name, _catalog_url(olfactory_family=pk)) for pk, name in queryset.values_list('pk', 'name')]
+
+
+def _ingredient_rows(ids=None):
+    queryset = Ingredient.objects.filter(show_in_fragrances=True)
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    return [(pk, name, _catalog_url(ingredient=pk)) for pk, name in queryset.values_list('pk', 'name')]
+
+
+def _note_rows(ids=None):
+    queryset = OlfactoryNote.objects.all()
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    # У нот нет отдельного фильтра — ищем по ним в полнотекстовом индексе каталога
+    return [(pk, name, _catalog_url(search=name)) for pk, name in queryset.values_list('pk', 'name')]
+
+
+LOADERS = {
+    'perfume': _perfume_rows,
+    'category': _category_rows,
+    'olfactory_family': _family_rows,
+    'ingredient': _ingredient_rows,
+    'note': _note_rows,
+}
+
+
+class AutocompleteIndex:
+    """
+    Отсортированный список (слово, тип, id) по названиям; префикс ищется бинарным поиском.
+    Каждое слово названия индексируется отдельно, поэтому «regina» находит «Acqua della Regina».
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._tokens = []
+        self._entries = {}
+
+    def _ensure_fresh(self):
+        version = get_version(AUTOCOMPLETE)
+        if self._version != version:
+            self._rebuild()
+            self._version = version
+
+    def _rebuild(self):
+        self._tokens = []
+        self._entries = {}
+        for kind, load in LOADERS.items():
+            for row in load():
+                self._add(kind, *row, sort=False)
+        self._tokens.sort()
+
+    def _add(self, kind, pk, label, url, sort=True):
+        words = tuple(dict.fromkeys(normalize_query(label).split()))
+        self._entries[(kind, pk)] = {
+            'type': kind, 'label': label, 'url': url, 'name': normalize_query(label), 'words': words,
+        }
+        for word in words:
+            if sort:
+                insort(self._tokens, (word, kind, pk))
+            else:
+                self._tokens.append((word, kind, pk))
+
+    def _remove(self, kind, pk):
+        entry = self._entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for word in entry['words']:
+            position = bisect_left(self._tokens, (word, kind, pk))
+            if position < len(self._tokens) and self._tokens[position] == (word, kind, pk):
+                del self._tokens[position]
+
+    def refresh(self, kind, ids, version):
+        """Переиндексирует отдельные объекты одного типа без полной перестройки"""
+        with self._lock:
+            if self._version is None or self._version != version - 1:
+                self._version = None
+                return
+            ids = list(ids)
+            for pk in ids:
+                self._remove(kind, pk)
+            for row in LOADERS[kind](ids):
+                self._add(kind, *row)
+            self._version = version
+
+    def _prefix_matches(self, prefix):
+        matches = set()
+        position = bisect_left(self._tokens, (prefix,))
+        while position < len(self._tokens) and self._tokens[position][0].startswith(prefix):
+            _, kind, pk = self._tokens[position]
+            matches.add((kind, pk))
+            position += 1
+        return matches
+
+    def suggest(self, query, limit=SUGGESTION_LIMIT):
+        terms = normalize_query(query).split()
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            # Каждое слово запроса должно быть префиксом какого-нибудь слова названия
+            matches = self._prefix_matches(terms[0])
+            for term in terms[1:]:
+                if not matches:
+                    break
+                matches &= self._prefix_matches(term)
+
+            phrase = ' '.join(terms)
+            entries = sorted(
+                (self._entries[key] for key in matches),
+                key=lambda entry: (
+                    not entry['name'].startswith(phrase),
+                    KINDS.index(entry['type']),
+                    len(entry['label']),
+                    entry['label'],
+                ),
+            )
+            return [
+                {'type': entry['type'], 'label': entry['label'], 'url': entry['url']}
+                for entry in entries[:limit]
+            ]
+
+
+autocomplete_index = AutocompleteIndex()
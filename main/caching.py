@@ -0,0 +1,76 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+
+
+# Пространства версий: парфюм (по id), категории и прочая таксономия меню, объёмы,
+# блоки главной страницы, каталог целиком, индекс автодополнения, рекомендации,
+# варианты изображений и списки пробников и упаковок в корзине.
+# Смена версии делает старые ключи недостижимыми.
+PERFUME = 'perfume'
+CATEGORY = 'category'
+CAPACITY = 'capacity'
+HOME = 'home'
+CATALOG = 'catalog'
+AUTOCOMPLETE = 'autocomplete'
+RECOMMENDATIONS = 'recommendations'
+IMAGES = 'images'
+PICKERS = 'pickers'
+
+
+def _version_key(namespace, pk=None):
+    return f'version:{namespace}' if pk is None else f'version:{namespace}:{pk}'
+
+
+def get_versions(*entities):
+    """entities — пары (namespace, pk); все версии читаются одним запросом к кэшу"""
+    keys = [_version_key(*entity) for entity in entities]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, 1, None)
+    return [found.get(key, 1) for key in keys]
+
+
+def get_version(namespace, pk=None):
+    return get_versions((namespace, pk))[0]
+
+
+def bump_version(namespace, pk=None):
+    key = _version_key(namespace, pk)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+        return 2
+
+
+def bump_versions(namespace, pks):
+    for pk in set(pks):
+        bump_version(namespace, pk)
+
+
+def get_catalog_version():
+    return get_version(CATALOG)
+
+
+def bump_catalog_version():
+    return bump_version(CATALOG)
+
+
+def canonical_query_string(params, exclude=()):
+    """Одинаковый набор фильтров в любом порядке даёт одну и ту же строку"""
+    items = []
+    for key in sorted(params.keys()):
+        if key in exclude:
+            continue
+        for value in sorted(set(params.getlist(key))):
+            if value != '':
+                items.append((key, value))
+    return urlencode(items)
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'{prefix}:{digest}'
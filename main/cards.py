@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from .models import Perfume, PerfumeCapacity, Category, CategoryClosure, CatalogCard
+
+
+def _category_paths():
+    categories = {
+        category_id: (slug, filter_slug)
+        for category_id, slug, filter_slug in Category.objects.values_list('id', 'slug', 'filter_slug')
+    }
+    ancestors = defaultdict(list)
+    for descendant_id, slug in CategoryClosure.objects.order_by('-depth').values_list(
+        'descendant_id', 'ancestor__slug'
+    ):
+        ancestors[descendant_id].append(slug)
+
+    def path(category_id):
+        return '/' + '/'.join(ancestors.get(category_id, ())) + '/'
+
+    return path, categories
+
+
+def build_card(perfume, capacities, category_path, category_filter_slug):
+    # Карточка показывает цену самого дешёвого объёма — её же спишет корзина; без объёмов — цену парфюма
+    priced = [capacity for capacity in capacities if capacity.effective_price is not None]
+    cheapest = min(priced, key=lambda capacity: capacity.effective_price, default=None)
+    return CatalogCard(
+        perfume=perfume,
+        name=perfume.name,
+        slug=perfume.slug,
+        image=perfume.image.name,
+        image_width=perfume.image_width,
+        image_height=perfume.image_height,
+        image_placeholder=perfume.image_placeholder,
+        price=cheapest.price if cheapest else perfume.price,
+        discount=perfume.discount,
+        effective_price=cheapest.effective_price if cheapest else perfume.effective_price,
+        max_capacity_price=max(capacity.effective_price for capacity in priced) if priced else perfume.effective_price,
+        in_stock=any(capacity.quantity > 0 for capacity in capacities),
+        capacity_volumes=sorted(capacity.capacity.volume for capacity in capacities),
+        category_id=perfume.category_id,
+        category_path=category_path,
+        category_filter_slug=category_filter_slug,
+        olfactory_family_id=perfume.olfactory_family_id,
+        order=perfume.order,
+        show_on_hero=perfume.show_on_hero,
+        show_in_featured=perfume.show_in_featured,
+        show_in_best_sellers=perfume.show_in_best_sellers,
+    )
+
+
+def refresh_catalog_cards(perfume_ids=None):
+    """
+    Пересобирает карточки указанных парфюмов (или всего каталога, если perfume_ids=None).
+    Недоступные и удалённые парфюмы теряют карточку.
+    """
+    perfumes = Perfume.objects.filter(available=True)
+    stale = CatalogCard.objects.all()
+    if perfume_ids is not None:
+        perfume_ids = list(perfume_ids)
+        perfumes = perfumes.filter(pk__in=perfume_ids)
+        stale = stale.filter(pk__in=perfume_ids)
+
+    capacities = defaultdict(list)
+    for capacity in PerfumeCapacity.objects.filter(
+        perfume__in=perfumes, available=True
+    ).select_related('capacity'):
+        capacities[capacity.perfume_id].append(capacity)
+
+    category_path, categories = _category_paths()
+    cards = []
+    for perfume in perfumes:
+        slug, filter_slug = categories.get(perfume.category_id, ('', ''))
+        cards.append(build_card(
+            perfume, capacities[perfume.pk], category_path(perfume.category_id), filter_slug or slug
+        ))
+
+    stale.exclude(pk__in=[card.pk for card in cards]).delete()
+    CatalogCard.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=['perfume'],
+        update_fields=[
+            field.name for field in CatalogCard._meta.concrete_fields if not field.primary_key
+        ],
+    )
+    return len(cards)
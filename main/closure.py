@@ -0,0 +1,50 @@
+from django.db import connection
+
+from .models import Category, CategoryClosure
+
+
+def insert_category(category):
+    """Связывает новую категорию с собой и со всеми предками родителя"""
+    links = [CategoryClosure(ancestor=category, descendant=category, depth=0)]
+    if category.parent_id:
+        links += [
+            CategoryClosure(ancestor_id=ancestor_id, descendant=category, depth=depth + 1)
+            for ancestor_id, depth in CategoryClosure.objects.filter(
+                descendant_id=category.parent_id
+            ).values_list('ancestor_id', 'depth')
+        ]
+    CategoryClosure.objects.bulk_create(links, ignore_conflicts=True)
+
+
+def move_category(category):
+    """Переносит поддерево категории под её текущего родителя"""
+    table = CategoryClosure._meta.db_table
+    with connection.cursor() as cursor:
+        # Отвязываем поддерево от старых предков
+        cursor.execute(f'''
+            DELETE FROM {table}
+            WHERE descendant_id IN (SELECT descendant_id FROM {table} WHERE ancestor_id = %s)
+              AND ancestor_id NOT IN (SELECT descendant_id FROM {table} WHERE ancestor_id = %s)
+        ''', [category.pk, category.pk])
+        if category.parent_id:
+            # Привязываем его ко всем предкам нового родителя
+            cursor.execute(f'''
+                INSERT INTO {table} (ancestor_id, descendant_id, depth)
+                SELECT super.ancestor_id, sub.descendant_id, super.depth + sub.depth + 1
+                FROM {table} super, {table} sub
+                WHERE super.descendant_id = %s AND sub.ancestor_id = %s
+            ''', [category.parent_id, category.pk])
+
+
+def rebuild_category_closure():
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    links = []
+    for category_id in parents:
+        ancestor_id, depth, seen = category_id, 0, set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            links.append(CategoryClosure(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    CategoryClosure.objects.all().delete()
+    CategoryClosure.objects.bulk_create(links)
+    return len(links)
@@ -1,23 +1,39 @@
-from .models import Category, OlfactoryFamily, Ingredient, Perfume
 from django.shortcuts import render
-from django.db.models import Q
-from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from .menu import get_menu_data
+from .search import unified_search
+
+
+def is_partial(request):
+    # HTMX-фрагменты и админка не выводят меню сайта
+    match = getattr(request, 'resolver_match', None)
+    return request.headers.get('HX-Request') == 'true' or (match is not None and match.namespace == 'admin')
+
+
+def _menu_items(request, *names):
+    if is_partial(request):
+        return {}
+    # Кэш читается один раз за запрос и только если шаблон действительно выводит меню
+    if not hasattr(request, '_menu_data'):
+        request._menu_data = SimpleLazyObject(get_menu_data)
+    menu = request._menu_data
+    return {name: SimpleLazyObject(lambda name=name: menu[name]) for name in names}
 
 
 def fragrance_menu(request):
-    return {
-        'fragrance_categories': Category.objects.filter(show_in_fragrances=True),
-        'olfactory_families': OlfactoryFamily.objects.all(),
-        'fragrance_ingredients': Ingredient.objects.filter(show_in_fragrances=True),
-    }
+    return _menu_items(request, 'fragrance_categories', 'olfactory_families', 'fragrance_ingredients')
+
 
 def navigation_categories(request):
-    cache_key = 'navigation_categories'
-    categories = cache.get(cache_key)
-    if not categories:
-        categories = Category.objects.all()[:3]
-        cache.set(cache_key, categories, 60 * 60)  
-    return {'navigation_categories': categories}
+    return _menu_items(request, 'navigation_categories')
+
+
+SEARCH_RESULT_KEYS = {
+    'perfume': 'results',
+    'category': 'categories',
+    'olfactory_family': 'olfactory_families',
+    'ingredient': 'ingredients',
+}
 
 
 def search_results(request):
@@ -31,24 +47,9 @@ def search_results(request):
     }
 
     if query:
-        # Search for perfumes
-        context['results'] = Perfume.objects.filter(
-            Q(name__icontains=query) & Q(available=True)
-        ).distinct()[:10]
-
-        # Search for categories
-        context['categories'] = Category.objects.filter(
-            Q(name__icontains=query) & Q(show_in_fragrances=True)
-        )[:5]
-
-        # Search for olfactory families
-        context['olfactory_families'] = OlfactoryFamily.objects.filter(
-            Q(name__icontains=query)
-        )[:5]
-
-        # Search for ingredients
-        context['ingredients'] = Ingredient.objects.filter(
-            Q(name__icontains=query) & Q(show_in_fragrances=True)
-        )[:5]
+        # Все типы одним запросом, внутри каждого — по убыванию релевантности
+        context['hits'] = unified_search(query)
+        for hit in context['hits']:
+            context[SEARCH_RESULT_KEYS[hit.kind]].append(hit)
 
     return render(request, 'search/results.html', context)
\ No newline at end of file
@@ -0,0 +1,270 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from .caching import get_catalog_version
+from .models import CatalogCard, CategoryClosure, Ingredient
+
+# Ценовые корзины для фильтра и счётчиков: (slug, нижняя граница, верхняя граница)
+PRICE_BUCKETS = (
+    ('0-100', Decimal('0'), Decimal('100')),
+    ('100-200', Decimal('100'), Decimal('200')),
+    ('200-300', Decimal('200'), Decimal('300')),
+    ('300+', Decimal('300'), None),
+)
+
+FACETS = ('category', 'capacity', 'olfactory_family', 'price_range')
+
+CARD_FIELDS = (
+    'perfume_id', 'category_id', 'olfactory_family_id', 'discount', 'effective_price', 'max_capacity_price',
+    'capacity_volumes',
+)
+
+
+def get_price_bucket(price):
+    for slug, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return slug
+    return None
+
+
+def parse_price(value):
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+
+
+class FacetResult:
+    def __init__(self, ids, counts, filtered=True):
+        self.ids = ids
+        self.counts = counts
+        # False — ничего не выбрано, ids содержит весь каталог и фильтровать выборку по нему не нужно
+        self.filtered = filtered
+
+    def count_for(self, facet, value):
+        return self.counts.get(facet, {}).get(str(value), 0)
+
+
+class FacetSnapshot:
+    """
+    Состояние индекса на одну версию каталога. После публикации не меняется,
+    поэтому запросы читают его без блокировки; обновления собирают новый снимок.
+    """
+
+    def __init__(self, version, perfumes, postings, category_ancestors, ingredient_families):
+        self.version = version
+        self.perfumes = perfumes
+        self.postings = postings
+        self.category_ancestors = category_ancestors
+        self.ingredient_families = ingredient_families
+        self.all_ids = frozenset(perfumes)
+        self.on_sale = frozenset(pk for pk, entry in perfumes.items() if entry['discount'] > 0)
+        # Отсортированные цены для фильтра диапазона бинарным поиском
+        by_min = sorted((entry['effective_price'], pk) for pk, entry in perfumes.items())
+        by_max = sorted((entry['max_capacity_price'], pk) for pk, entry in perfumes.items())
+        self.min_prices = [price for price, _ in by_min]
+        self.min_price_ids = [pk for _, pk in by_min]
+        self.max_prices = [price for price, _ in by_max]
+        self.max_price_ids = [pk for _, pk in by_max]
+
+    def priced_from(self, min_price):
+        # Хотя бы один объём не дешевле min_price
+        return set(self.max_price_ids[bisect_left(self.max_prices, min_price):])
+
+    def priced_up_to(self, max_price):
+        # Хотя бы один объём не дороже max_price
+        return set(self.min_price_ids[:bisect_right(self.min_prices, max_price)])
+
+
+class FacetIndex:
+    """Posting-листы доступных парфюмов по значениям фасетов каталога"""
+
+    def __init__(self):
+        # Блокировка нужна только для замены снимка; сами запросы идут параллельно
+        self._lock = threading.RLock()
+        self._snapshot = None
+
+    def _current(self):
+        version = get_catalog_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._snapshot = self._build(version)
+            return snapshot
+
+    def _build(self, version):
+        perfumes = {}
+        postings = {facet: {} for facet in FACETS}
+        category_ancestors = self._load_categories()
+        ingredient_families = {
+            str(ingredient_id): str(family_id)
+            for ingredient_id, family_id in Ingredient.objects.values_list('id', 'olfactory_family_id')
+        }
+
+        # Карточки каталога уже содержат всё нужное — один проход без join'ов
+        for row in CatalogCard.objects.values(*CARD_FIELDS):
+            entry = self._entry(row)
+            perfumes[entry['id']] = entry
+            for facet, values in self._entry_values(entry, category_ancestors).items():
+                for value in values:
+                    postings[facet].setdefault(value, set()).add(entry['id'])
+        return FacetSnapshot(version, perfumes, postings, category_ancestors, ingredient_families)
+
+    def _entry(self, row):
+        return {
+            'id': row['perfume_id'],
+            'category_id': row['category_id'],
+            'olfactory_family_id': row['olfactory_family_id'],
+            'discount': row['discount'],
+            'effective_price': row['effective_price'],
+            'max_capacity_price': row['max_capacity_price'],
+            'volumes': set(row['capacity_volumes']),
+        }
+
+    def _load_categories(self):
+        # Слаги категории и всех её предков — из таблицы замыкания одним запросом
+        category_ancestors = defaultdict(list)
+        for category_id, slug in CategoryClosure.objects.values_list('descendant_id', 'ancestor__slug'):
+            category_ancestors[category_id].append(slug)
+        return category_ancestors
+
+    def _entry_values(self, entry, category_ancestors):
+        values = {
+            # Парфюм попадает в свою категорию и во все родительские
+            'category': set(category_ancestors.get(entry['category_id'], ())),
+            'capacity': set(entry['volumes']),
+            'olfactory_family': set(),
+            'price_range': set(),
+        }
+        if entry['olfactory_family_id'] is not None:
+            values['olfactory_family'].add(str(entry['olfactory_family_id']))
+        bucket = get_price_bucket(entry['effective_price'])
+        if bucket:
+            values['price_range'].add(bucket)
+        return values
+
+    def refresh_perfumes(self, perfume_ids, version):
+        """Переиндексирует отдельные парфюмы без полной перестройки индекса"""
+        with self._lock:
+            snapshot = self._snapshot
+            # Если версию успел поднять другой процесс, индекс перестроится при следующем запросе
+            if snapshot is None or snapshot.version != version - 1:
+                self._snapshot = None
+                return
+            perfume_ids = list(perfume_ids)
+            perfumes = dict(snapshot.perfumes)
+            postings = {facet: dict(values) for facet, values in snapshot.postings.items()}
+            copied = set()
+
+            def posting(facet, value):
+                # Копируются только затронутые списки: старый снимок могут читать текущие запросы
+                if (facet, value) not in copied:
+                    postings[facet][value] = set(postings[facet].get(value, ()))
+                    copied.add((facet, value))
+                return postings[facet][value]
+
+            for perfume_id in perfume_ids:
+                entry = perfumes.pop(perfume_id, None)
+                if entry is None:
+                    continue
+                for facet, values in self._entry_values(entry, snapshot.category_ancestors).items():
+                    for value in values:
+                        if value in postings[facet]:
+                            posting(facet, value).discard(perfume_id)
+            for row in CatalogCard.objects.filter(pk__in=perfume_ids).values(*CARD_FIELDS):
+                entry = self._entry(row)
+                perfumes[entry['id']] = entry
+                for facet, values in self._entry_values(entry, snapshot.category_ancestors).items():
+                    for value in values:
+                        posting(facet, value).add(entry['id'])
+            for facet, value in copied:
+                if not postings[facet][value]:
+                    del postings[facet][value]
+
+            self._snapshot = FacetSnapshot(
+                version, perfumes, postings, snapshot.category_ancestors, snapshot.ingredient_families
+            )
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def query(self, selections, min_price=None, max_price=None, on_sale=False):
+        """
+        Возвращает id подходящих парфюмов и счётчики для каждого значения фасетов.
+        Внутри фасета значения объединяются по OR, между фасетами — по AND;
+        счётчик значения считается с учётом выбора во всех остальных фасетах.
+        """
+        snapshot = self._current()
+
+        selections = dict(selections)
+        ingredient_id = selections.pop('ingredient', None)
+        if ingredient_id:
+            family_id = snapshot.ingredient_families.get(str(ingredient_id))
+            families = set(selections.get('olfactory_family') or ())
+            if family_id is None:
+                return FacetResult(set(), {facet: {} for facet in FACETS})
+            selections['olfactory_family'] = [family_id] if not families or family_id in families else []
+
+        # Фильтры по цене и «On Sale» работают по ценам объёмов, которые видит покупатель
+        restrictions = []
+        if min_price is not None:
+            restrictions.append(snapshot.priced_from(min_price))
+        if max_price is not None:
+            restrictions.append(snapshot.priced_up_to(max_price))
+        if on_sale:
+            restrictions.append(snapshot.on_sale)
+        base = snapshot.all_ids
+        for restriction in sorted(restrictions, key=len):
+            base = base & restriction
+
+        matches = {}
+        for facet in FACETS:
+            values = selections.get(facet)
+            if values is None:
+                continue
+            matched = set()
+            for value in values:
+                matched |= snapshot.postings[facet].get(str(value), set())
+            matches[facet] = matched
+
+        ids = base
+        for matched in sorted(matches.values(), key=len):
+            ids = ids & matched
+
+        counts = {}
+        for facet in FACETS:
+            others = base
+            for other, matched in matches.items():
+                if other != facet:
+                    others = others & matched
+            if others is snapshot.all_ids:
+                counts[facet] = {value: len(posting) for value, posting in snapshot.postings[facet].items()}
+            else:
+                counts[facet] = {
+                    value: len(posting & others) for value, posting in snapshot.postings[facet].items()
+                }
+
+        return FacetResult(ids, counts, filtered=ids is not snapshot.all_ids)
+
+
+facet_index = FacetIndex()
+
+
+def get_facet_selections(params):
+    selections = {}
+    for facet in FACETS:
+        values = [value for value in params.getlist(facet) if value]
+        if values:
+            selections[facet] = values
+    if params.get('ingredient'):
+        selections['ingredient'] = params.get('ingredient')
+    return selections
+
@@ -0,0 +1,14 @@
+from django.db import models
+
+
+class DimensionsImageField(models.ImageField):
+    """
+    ImageField с width_field/height_field, который не открывает файл при загрузке модели из базы.
+    Стандартный ImageField читает файл на post_init у каждой строки без размеров,
+    а на отсутствующем файле падает. Здесь размеры обновляются только при присвоении нового файла;
+    старые строки заполняет команда backfill_image_metadata.
+    """
+
+    def update_dimension_fields(self, instance, force=False, *args, **kwargs):
+        if force:
+            super().update_dimension_fields(instance, force=True, *args, **kwargs)
@@ -0,0 +1,185 @@
+import logging
+import os
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .caching import bump_version, make_key, IMAGES, PERFUME
+from .models import CatalogCard, ImageBatchJob, ImageVariant, Perfume, PerfumeImage
+from .utils.image_utils import VARIANT_FORMATS, compress_image, image_metadata, make_placeholder, open_image, \
+    render_variant, supported_variant_formats
+
+logger = logging.getLogger(__name__)
+
+# Ширины вариантов: карточка каталога ~300px, на retina и планшетах — больше
+VARIANT_WIDTHS = (320, 640, 960, 1280)
+
+# Поля изображений, для которых строятся варианты: (app_label, модель, поле)
+IMAGE_FIELDS = (
+    ('main', 'Perfume', 'image'),
+    ('main', 'PerfumeImage', 'image'),
+    ('samples', 'Sample', 'image'),
+    ('gifts', 'Gift', 'image'),
+)
+
+VARIANTS_TIMEOUT = 60 * 60 * 24
+
+# Изображений в одной задаче пакетного сжатия: части разбирают параллельно процессы воркера
+BATCH_CHUNK_SIZE = 20
+
+
+def _variants_key(source):
+    return make_key('image_variants', source)
+
+
+def generate_variants(source, force=False):
+    """Строит варианты всех ширин (без увеличения) во всех поддерживаемых форматах"""
+    if not source or not default_storage.exists(source):
+        return 0
+    if not force and ImageVariant.objects.filter(source=source).exists():
+        return 0
+
+    delete_variants(source)
+    with default_storage.open(source) as file:
+        img = open_image(file, max_dimension=max(VARIANT_WIDTHS))
+        img.load()
+    store_placeholder(source, make_placeholder(img))
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    variants = []
+    for fmt in supported_variant_formats():
+        for width in VARIANT_WIDTHS:
+            if width >= img.width:
+                break
+            data, height = render_variant(img, width, fmt)
+            variant = ImageVariant(source=source, width=width, height=height, format=fmt)
+            variant.file.save(f'{stem}-{width}w.{fmt}', ContentFile(data), save=False)
+            variants.append(variant)
+
+    ImageVariant.objects.bulk_create(variants)
+    cache.delete(_variants_key(source))
+    # Закэшированные страницы должны получить srcset
+    transaction.on_commit(lambda: bump_version(IMAGES))
+    return len(variants)
+
+
+def store_placeholder(source, placeholder):
+    # При загрузке в админке превью не строится: файл декодируется только здесь, в фоне
+    for model in (Perfume, PerfumeImage, CatalogCard):
+        model.objects.filter(image=source, image_placeholder='').update(image_placeholder=placeholder)
+
+
+def delete_variants(source):
+    variants = list(ImageVariant.objects.filter(source=source))
+    for variant in variants:
+        variant.file.delete(save=False)
+    ImageVariant.objects.filter(pk__in=[variant.pk for variant in variants]).delete()
+    cache.delete(_variants_key(source))
+
+
+def _load_variants(source):
+    srcsets = {}
+    for fmt, width, name in ImageVariant.objects.filter(source=source).values_list('format', 'width', 'file'):
+        srcsets.setdefault(fmt, []).append((width, name))
+    return srcsets
+
+
+def get_variants(source):
+    """{формат: [(ширина, имя файла), ...]} по возрастанию ширины; читается из кэша"""
+    if not source:
+        return {}
+    return cache.get_or_set(_variants_key(source), lambda: _load_variants(source), VARIANTS_TIMEOUT)
+
+
+def build_srcsets(source):
+    """Готовые значения srcset по MIME-типам, в порядке предпочтения форматов"""
+    variants = get_variants(source)
+    return [
+        (VARIANT_FORMATS[fmt][0], ', '.join(f'{default_storage.url(name)} {width}w' for width, name in variants[fmt]))
+        for fmt in VARIANT_FORMATS
+        if variants.get(fmt)
+    ]
+
+
+def process_perfume_image(image_id):
+    """
+    Ужимает загруженное изображение галереи и строит его варианты.
+    Статус pending → processing → ready (или failed с текстом ошибки).
+    """
+    # Одновременно одно изображение обрабатывает только одна задача
+    if not PerfumeImage.objects.filter(pk=image_id, status__in=('pending', 'failed')).update(status='processing'):
+        return False
+    image = PerfumeImage.objects.get(pk=image_id)
+    source = image.image.name
+
+    try:
+        # Файлы не больше порога уже сжаты или в сжатии не нуждались: повторное сжатие JPEG только портит их
+        if not source or image.image.size <= PerfumeImage.COMPRESS_THRESHOLD:
+            PerfumeImage.objects.filter(pk=image_id).update(status='ready', processing_error='')
+            return False
+        with default_storage.open(source) as file:
+            content, extension = compress_image(file)
+        width, height, placeholder = image_metadata(content)
+        name = default_storage.save(os.path.splitext(source)[0] + extension, content)
+    except Exception as error:
+        logger.exception('Failed to compress perfume image %s', image_id)
+        PerfumeImage.objects.filter(pk=image_id).update(status='failed', processing_error=str(error))
+        return False
+
+    # update() не вызывает post_save; если за это время загрузили другой файл, он не перезаписывается
+    if not PerfumeImage.objects.filter(pk=image_id, image=source).update(
+        image=name, image_width=width, image_height=height, image_placeholder=placeholder,
+        status='ready', processing_error='',
+    ):
+        default_storage.delete(name)
+        return False
+
+    default_storage.delete(source)
+    delete_variants(source)
+    generate_variants(name)
+    transaction.on_commit(lambda: bump_version(PERFUME, image.product_id))
+    return True
+
+
+def start_image_batch(queryset):
+    """Создаёт пакет сжатия для выбранных изображений; уже обрабатываемые пропускаются"""
+    image_ids = list(queryset.exclude(status='processing').values_list('pk', flat=True))
+    PerfumeImage.objects.filter(pk__in=image_ids).update(status='pending', processing_error='')
+    return ImageBatchJob.objects.create(image_ids=image_ids, total=len(image_ids))
+
+
+def resume_image_batch(job):
+    """
+    Возвращает в очередь всё, что не сжато: упавшие изображения и зависшие в processing
+    после гибели воркера. Возвращает id изображений, которые нужно обработать заново.
+    """
+    image_ids = list(
+        PerfumeImage.objects.filter(pk__in=job.image_ids).exclude(status='ready').values_list('pk', flat=True)
+    )
+    PerfumeImage.objects.filter(pk__in=image_ids).update(status='pending', processing_error='')
+    ImageBatchJob.objects.filter(pk=job.pk).update(status='queued', finished_at=None)
+    job.refresh_progress()
+    return image_ids
+
+
+def batch_chunks(image_ids):
+    return [image_ids[start:start + BATCH_CHUNK_SIZE] for start in range(0, len(image_ids), BATCH_CHUNK_SIZE)]
+
+
+def process_image_batch_chunk(job_id, image_ids, redelivered=False):
+    job = ImageBatchJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return 0
+    if redelivered:
+        # Предыдущий воркер умер посреди части — его изображения так и остались в processing
+        PerfumeImage.objects.filter(pk__in=image_ids, status='processing').update(status='pending')
+    ImageBatchJob.objects.filter(pk=job_id, status='queued').update(status='running')
+
+    done = 0
+    for image_id in image_ids:
+        done += process_perfume_image(image_id)
+    # Прогресс — один агрегирующий запрос на часть, а не на каждое изображение
+    job.refresh_progress()
+    return done
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image, UnidentifiedImageError
+
+from main.caching import bump_versions, PERFUME
+from main.models import Perfume, PerfumeImage, fill_image_metadata
+from main.signals import catalog_changed
+
+BATCH_SIZE = 200
+METADATA_FIELDS = ['image_width', 'image_height', 'image_placeholder']
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры и размытые превью изображений парфюмов, загруженных до их появления'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересчитать и уже заполненные')
+
+    def handle(self, *args, **options):
+        missing = Q() if options['force'] else Q(image_width__isnull=True) | Q(image_placeholder='')
+        perfume_ids = self.backfill(Perfume.objects.exclude(image='').filter(missing), lambda obj: obj.pk)
+        gallery_ids = self.backfill(
+            PerfumeImage.objects.exclude(image='').filter(missing, status='ready'), lambda obj: obj.product_id
+        )
+
+        with transaction.atomic():
+            # Карточки каталога хранят копию размеров и превью
+            catalog_changed(perfume_ids)
+            transaction.on_commit(lambda: bump_versions(PERFUME, gallery_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f'Perfume images updated: {len(perfume_ids)}, gallery images updated: {len(gallery_ids)}'
+        ))
+
+    def backfill(self, queryset, perfume_id):
+        """Обрабатывает строки пачками; возвращает id затронутых парфюмов"""
+        updated, batch = set(), []
+        for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+            # Один битый или слишком большой файл не должен останавливать всю команду
+            try:
+                fill_image_metadata(obj)
+            except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as error:
+                self.stderr.write(f'Cannot read {obj.image.name}: {error}')
+                continue
+            batch.append(obj)
+            updated.add(perfume_id(obj))
+            if len(batch) >= BATCH_SIZE:
+                queryset.model.objects.bulk_update(batch, METADATA_FIELDS)
+                batch = []
+        queryset.model.objects.bulk_update(batch, METADATA_FIELDS)
+        return updated
@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from main.images import IMAGE_FIELDS, generate_variants
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные варианты (WebP/AVIF) для всех загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перестроить уже существующие варианты')
+
+    def handle(self, *args, **options):
+        total = 0
+        for app_label, model_name, field_name in IMAGE_FIELDS:
+            model = apps.get_model(app_label, model_name)
+            sources = model.objects.exclude(**{field_name: ''}).values_list(field_name, flat=True).distinct()
+            for source in sources.iterator():
+                total += generate_variants(source, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f'Image variants created: {total}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.caching import bump_catalog_version
+from main.cards import refresh_catalog_cards
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает денормализованные карточки каталога'
+
+    def handle(self, *args, **options):
+        count = refresh_catalog_cards()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Catalog cards rebuilt: {count}'))
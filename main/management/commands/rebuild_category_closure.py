@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.closure import rebuild_category_closure
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу замыкания дерева категорий'
+
+    def handle(self, *args, **options):
+        count = rebuild_category_closure()
+        self.stdout.write(self.style.SUCCESS(f'Category closure rebuilt: {count} links'))
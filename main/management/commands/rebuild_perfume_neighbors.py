@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.recommendations import rebuild_perfume_neighbors
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих парфюмов для рекомендаций'
+
+    def handle(self, *args, **options):
+        count = rebuild_perfume_neighbors()
+        self.stdout.write(self.style.SUCCESS(f'Perfume neighbors rebuilt: {count}'))
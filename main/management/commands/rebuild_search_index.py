@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Perfume
+from main.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовые документы всех парфюмов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        ids = list(Perfume.objects.values_list('pk', flat=True).order_by('pk'))
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            update_search_vectors(ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {len(ids)} perfumes'))
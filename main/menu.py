@@ -0,0 +1,23 @@
+from django.core.cache import cache
+
+from .caching import get_version, make_key, CATEGORY
+from .models import Category, OlfactoryFamily, Ingredient
+
+MENU_TIMEOUT = 60 * 60 * 24
+
+
+def build_menu_data():
+    return {
+        'navigation_categories': list(Category.objects.values('id', 'name', 'slug')[:3]),
+        'fragrance_categories': list(Category.objects.filter(show_in_fragrances=True).values('id', 'name', 'slug')),
+        'olfactory_families': list(OlfactoryFamily.objects.values('id', 'name')),
+        'fragrance_ingredients': list(Ingredient.objects.filter(show_in_fragrances=True).values('id', 'name')),
+    }
+
+
+def get_menu_data():
+    """
+    Пункты меню и навигации в виде простых словарей под версионным ключом.
+    Версию категорий поднимают сигналы Category/OlfactoryFamily/Ingredient.
+    """
+    return cache.get_or_set(make_key('menu', get_version(CATEGORY)), build_menu_data, MENU_TIMEOUT)
@@ -0,0 +1,64 @@
+# Generated by Django 5.2 on 2026-10-18 02:49
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+NOTES_SQL = """
+    SELECT string_agg(n.name, ' ') FROM main_olfactorynote n
+    WHERE n.id IN (
+        SELECT olfactorynote_id FROM main_perfume_top_notes WHERE perfume_id = p.id
+        UNION SELECT olfactorynote_id FROM main_perfume_middle_notes WHERE perfume_id = p.id
+        UNION SELECT olfactorynote_id FROM main_perfume_base_notes WHERE perfume_id = p.id
+    )
+"""
+
+POPULATE_SQL = f"""
+    UPDATE main_perfume p SET search_vector =
+        setweight(to_tsvector('simple', coalesce(p.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(({NOTES_SQL}), '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(f.name, '') || ' ' || c.name), 'C') ||
+        setweight(to_tsvector('simple', coalesce(p.description, '')), 'D')
+    FROM main_category c, main_perfume p2
+    LEFT JOIN main_olfactoryfamily f ON f.id = p2.olfactory_family_id
+    WHERE c.id = p.category_id AND p2.id = p.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='perfume',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='category_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredient_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='olfactoryfamily',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='olfactoryfamily_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='perfume_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='perfume_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunSQL(POPULATE_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2 on 2026-10-18 02:53
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_cards(apps, schema_editor):
+    Perfume = apps.get_model('main', 'Perfume')
+    PerfumeCapacity = apps.get_model('main', 'PerfumeCapacity')
+    Category = apps.get_model('main', 'Category')
+    CatalogCard = apps.get_model('main', 'CatalogCard')
+
+    categories = {c.id: c for c in Category.objects.all()}
+
+    def category_path(category_id):
+        slugs = []
+        while category_id in categories and len(slugs) < len(categories):
+            slugs.append(categories[category_id].slug)
+            category_id = categories[category_id].parent_id
+        return '/' + '/'.join(reversed(slugs)) + '/'
+
+    cards = []
+    for perfume in Perfume.objects.filter(available=True):
+        capacities = list(PerfumeCapacity.objects.filter(perfume=perfume, available=True).select_related('capacity'))
+        prices = [c.price for c in capacities if c.price is not None]
+        effective_price = perfume.price
+        if perfume.discount > 0:
+            effective_price = perfume.price * (1 - perfume.discount / 100)
+        category = categories[perfume.category_id]
+        cards.append(CatalogCard(
+            perfume=perfume,
+            name=perfume.name,
+            slug=perfume.slug,
+            image=perfume.image.name,
+            price=perfume.price,
+            discount=perfume.discount,
+            effective_price=round(effective_price, 2),
+            min_capacity_price=min(prices) if prices else None,
+            max_capacity_price=max(prices) if prices else None,
+            in_stock=any(c.quantity > 0 for c in capacities),
+            capacity_volumes=sorted(c.capacity.volume for c in capacities),
+            category_id=perfume.category_id,
+            category_path=category_path(perfume.category_id),
+            category_filter_slug=category.filter_slug or category.slug,
+            olfactory_family_id=perfume.olfactory_family_id,
+            order=perfume.order,
+            show_on_hero=perfume.show_on_hero,
+            show_in_featured=perfume.show_in_featured,
+            show_in_best_sellers=perfume.show_in_best_sellers,
+        ))
+    CatalogCard.objects.bulk_create(cards)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_perfume_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCard',
+            fields=[
+                ('perfume', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='main.perfume')),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField()),
+                ('image', models.ImageField(blank=True, upload_to='products/%Y/%m/%d')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('discount', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('effective_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('min_capacity_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_capacity_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('capacity_volumes', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), blank=True, default=list, size=None)),
+                ('category_path', models.CharField(db_index=True, help_text='Слаги категорий от корня: /parent/child/', max_length=500)),
+                ('category_filter_slug', models.SlugField()),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('show_on_hero', models.BooleanField(default=False)),
+                ('show_in_featured', models.BooleanField(default=False)),
+                ('show_in_best_sellers', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.category')),
+                ('olfactory_family', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.olfactoryfamily')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order', 'perfume'], name='card_order_idx'), models.Index(fields=['price', 'perfume'], name='card_price_idx'), models.Index(fields=['-price', '-perfume'], name='card_price_desc_idx'), django.contrib.postgres.indexes.GinIndex(fields=['capacity_volumes'], name='card_capacity_volumes_gin'), django.contrib.postgres.indexes.GinIndex(fields=['name'], name='card_name_trgm', opclasses=['gin_trgm_ops'])],
+            },
+        ),
+        migrations.RunPython(populate_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2 on 2026-10-18 02:54
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from django.db import migrations, models
+
+
+CAPACITY_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION main_perfumecapacity_set_effective_price() RETURNS trigger AS $$
+    BEGIN
+        SELECT ROUND(COALESCE(NEW.price, p.price) * (100 - p.discount) / 100, 2)
+          INTO NEW.effective_price
+          FROM main_perfume p WHERE p.id = NEW.perfume_id;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER perfumecapacity_effective_price
+        BEFORE INSERT OR UPDATE OF price, perfume_id, effective_price ON main_perfumecapacity
+        FOR EACH ROW EXECUTE FUNCTION main_perfumecapacity_set_effective_price();
+
+    CREATE OR REPLACE FUNCTION main_perfume_sync_capacity_prices() RETURNS trigger AS $$
+    BEGIN
+        UPDATE main_perfumecapacity
+           SET effective_price = ROUND(COALESCE(price, NEW.price) * (100 - NEW.discount) / 100, 2)
+         WHERE perfume_id = NEW.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER perfume_capacity_prices
+        AFTER UPDATE OF price, discount ON main_perfume
+        FOR EACH ROW
+        WHEN (OLD.price IS DISTINCT FROM NEW.price OR OLD.discount IS DISTINCT FROM NEW.discount)
+        EXECUTE FUNCTION main_perfume_sync_capacity_prices();
+
+    UPDATE main_perfumecapacity SET price = price;
+
+    UPDATE main_catalogcard c
+       SET effective_price = p.effective_price,
+           min_capacity_price = (SELECT MIN(pc.effective_price) FROM main_perfumecapacity pc
+                                  WHERE pc.perfume_id = p.id AND pc.available),
+           max_capacity_price = (SELECT MAX(pc.effective_price) FROM main_perfumecapacity pc
+                                  WHERE pc.perfume_id = p.id AND pc.available)
+      FROM main_perfume p
+     WHERE p.id = c.perfume_id;
+"""
+
+DROP_CAPACITY_TRIGGER_SQL = """
+    DROP TRIGGER IF EXISTS perfume_capacity_prices ON main_perfume;
+    DROP FUNCTION IF EXISTS main_perfume_sync_capacity_prices();
+    DROP TRIGGER IF EXISTS perfumecapacity_effective_price ON main_perfumecapacity;
+    DROP FUNCTION IF EXISTS main_perfumecapacity_set_effective_price();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_catalog_card'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='catalogcard',
+            name='card_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='catalogcard',
+            name='card_price_desc_idx',
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='effective_price',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price'), '*', django.db.models.expressions.CombinedExpression(models.Value(100), '-', models.F('discount'))), '/', models.Value(100)), 2), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+        migrations.AddField(
+            model_name='perfumecapacity',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='catalogcard',
+            index=models.Index(fields=['effective_price', 'perfume'], name='card_effective_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogcard',
+            index=models.Index(fields=['-effective_price', '-perfume'], name='card_effective_price_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perfume',
+            index=models.Index(fields=['effective_price', 'id'], name='perfume_effective_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='perfumecapacity',
+            index=models.Index(fields=['effective_price'], name='capacity_effective_price_idx'),
+        ),
+        migrations.RunSQL(CAPACITY_TRIGGER_SQL, DROP_CAPACITY_TRIGGER_SQL),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_category_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfumecapacity',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
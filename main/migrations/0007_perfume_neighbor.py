@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_perfumecapacity_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PerfumeNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_of', to='main.perfume')),
+                ('perfume', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='main.perfume')),
+            ],
+            options={
+                'ordering': ['perfume', 'rank'],
+                'unique_together': {('perfume', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 03:17
+
+import main.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_image_batch_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogcard',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='catalogcard',
+            name='image_placeholder',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='catalogcard',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, help_text='Размытое превью 16px в виде data URI'),
+        ),
+        migrations.AddField(
+            model_name='perfume',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='perfumeimage',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='perfumeimage',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='perfumeimage',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='perfume',
+            name='image',
+            field=main.fields.DimensionsImageField(blank=True, height_field='image_height', upload_to='products/%Y/%m/%d', width_field='image_width'),
+        ),
+        migrations.AlterField(
+            model_name='perfumeimage',
+            name='image',
+            field=main.fields.DimensionsImageField(blank=True, height_field='image_height', upload_to='products/%Y/%m/%d', width_field='image_width'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 03:51
+
+from django.db import migrations, models
+
+
+# Карточка берёт цену самого дешёвого объёма; без объёмов обе границы — цена парфюма
+CARD_PRICES_SQL = """
+    UPDATE main_catalogcard c
+       SET effective_price = COALESCE(c.min_capacity_price, c.effective_price),
+           price = COALESCE((SELECT pc.price FROM main_perfumecapacity pc
+                              WHERE pc.perfume_id = c.perfume_id AND pc.available
+                                AND pc.effective_price IS NOT NULL
+                              ORDER BY pc.effective_price, pc.id LIMIT 1), c.price),
+           max_capacity_price = COALESCE(c.max_capacity_price, c.effective_price);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_image_metadata'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CARD_PRICES_SQL, migrations.RunSQL.noop),
+        migrations.RemoveIndex(
+            model_name='catalogcard',
+            name='card_effective_price_desc_idx',
+        ),
+        migrations.RemoveField(
+            model_name='catalogcard',
+            name='min_capacity_price',
+        ),
+        migrations.AlterField(
+            model_name='catalogcard',
+            name='max_capacity_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10),
+        ),
+        migrations.AddIndex(
+            model_name='catalogcard',
+            index=models.Index(fields=['-max_capacity_price', '-perfume'], name='card_max_price_desc_idx'),
+        ),
+    ]
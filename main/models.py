@@ -1,6 +1,17 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.exceptions import ValidationError
 from django.db import models
-from .utils.image_utils import compress_image
+from django.db.models import F
+from django.db.models.functions import Round
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .fields import DimensionsImageField
+from .utils.image_utils import image_metadata, image_size
 
 
 class Capacity(models.Model):
@@ -40,6 +51,10 @@ class OlfactoryFamily(models.Model):
 
     def __str__(self):
         return self.name
+
+
+    class Meta:
+        indexes = [GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='olfactoryfamily_name_trgm')]
     
 
 class Ingredient(models.Model):
@@ -57,6 +72,7 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'ingredient'
         verbose_name_plural = 'ingredients'
+        indexes = [GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='ingredient_name_trgm')]
 
 
 class Category(models.Model):
@@ -81,15 +97,72 @@ class Category(models.Model):
         return self.name
 
 
+    def clean(self):
+        if self.pk and self.parent_id and CategoryClosure.objects.filter(
+            ancestor_id=self.pk, descendant_id=self.parent_id
+        ).exists():
+            raise ValidationError({'parent': "Category cannot be moved under itself or its subcategory."})
+
+
     class Meta:
         ordering = ['name']
-        indexes = [models.Index(fields=['name'])]
+        indexes = [
+            models.Index(fields=['name']),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='category_name_trgm'),
+        ]
         verbose_name = 'category'
         verbose_name_plural = 'categories'
         
 
     def get_item_count(self):
-        return Perfume.objects.filter(category=self).count()
+        """Число парфюмов в категории и во всех её подкатегориях"""
+        return Perfume.objects.filter(
+            category__ancestor_links__ancestor=self
+        ).count()
+
+
+    @classmethod
+    def with_item_counts(cls, queryset=None):
+        """Категории с числом парфюмов во всём поддереве — одним агрегирующим запросом"""
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.annotate(item_count=models.Count('descendant_links__descendant__perfumes'))
+
+
+class CategoryClosure(models.Model):
+    """Таблица замыкания дерева категорий: все пары (предок, потомок) с глубиной"""
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, 
+                                related_name='descendant_links')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, 
+                                  related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'depth'], name='closure_descendant_idx')]
+
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+
+def fill_image_size(instance):
+    """
+    Размеры нового файла поля image по заголовку; превью сбрасывается.
+    Превью строит задача вариантов (generate_image_variants) — декодировать файл в запросе дорого.
+    """
+    instance.image_placeholder = ''
+    try:
+        # Загруженный файл ещё предстоит сохранить в хранилище — закрывать его нельзя
+        instance.image_width, instance.image_height = image_size(instance.image)
+    except (OSError, Image.DecompressionBombError):
+        pass
+
+
+def fill_image_metadata(instance):
+    """Размеры и размытое превью уже сохранённого файла; ошибки чтения пробрасываются"""
+    with instance.image.open('rb') as file:
+        instance.image_width, instance.image_height, instance.image_placeholder = image_metadata(file)
 
 
 class Perfume(models.Model):
@@ -109,7 +182,12 @@ class Perfume(models.Model):
                                          limit_choices_to={'category__name': 'Middle'}, blank=True)
     base_notes = models.ManyToManyField(OlfactoryNote, related_name='base_notes', 
                                        limit_choices_to={'category__name': 'Base'}, blank=True)
-    image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True)
+    image = DimensionsImageField(upload_to='products/%Y/%m/%d', blank=True,
+                                 width_field='image_width', height_field='image_height')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False,
+                                         help_text="Размытое превью 16px в виде data URI")
     detail_media = models.FileField(upload_to='products/media/%Y/%m/%d', blank=True, 
                                    help_text="Upload an image or video for the detail page")
     created_at = models.DateTimeField(auto_now_add=True, null=True)
@@ -125,18 +203,41 @@ class Perfume(models.Model):
                                          verbose_name="Show in featured products section")
     show_in_best_sellers = models.BooleanField(default=False, 
                                              verbose_name="Show in best sellers section")
+    search_vector = SearchVectorField(null=True, editable=False)
+    effective_price = models.GeneratedField(
+        expression=Round(F('price') * (100 - F('discount')) / 100, 2),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
 
 
     def __str__(self):
         return self.name
 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['effective_price', 'id'], name='perfume_effective_price_idx'),
+            GinIndex(fields=['search_vector'], name='perfume_search_vector_gin'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='perfume_name_trgm'),
+        ]
+
+
     def get_price_with_discount(self):
+        # Округление как у ROUND() в PostgreSQL, чтобы совпадать с effective_price
         if self.discount > 0:
-            return round(self.price * (1 - (self.discount / 100)), 2)
-        return round(self.price, 2)
+            return (self.price * (1 - (self.discount / 100))).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        return self.price.quantize(Decimal('0.01'), ROUND_HALF_UP)
     
 
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            fill_image_size(self)
+        elif not self.image:
+            self.image_placeholder = ''
+        super().save(*args, **kwargs)
+
+
     def get_absolute_url(self):
         return reverse('main:perfume_detail', args=[self.slug])
 
@@ -148,10 +249,15 @@ class PerfumeCapacity(models.Model):
     available = models.BooleanField(default=True)
     quantity = models.PositiveIntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Цена объёма со скидкой парфюма; заполняется триггерами PostgreSQL (миграция 0004)
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, 
+                                          editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
     class Meta:
         unique_together = ('perfume', 'capacity')
+        indexes = [models.Index(fields=['effective_price'], name='capacity_effective_price_idx')]
         
 
     def __str__(self):
@@ -166,8 +272,23 @@ class PerfumeCapacity(models.Model):
 
 class PerfumeImage(models.Model):
     """Изображения парфюма"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    # Загрузки больше этого размера ужимаются в фоне задачей process_perfume_image
+    COMPRESS_THRESHOLD = 5 * 1024 * 1024
+
     product = models.ForeignKey(Perfume, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True)
+    image = DimensionsImageField(upload_to='products/%Y/%m/%d', blank=True,
+                                 width_field='image_width', height_field='image_height')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready', editable=False)
+    processing_error = models.TextField(blank=True, editable=False)
     
 
     def __str__(self):
@@ -175,6 +296,142 @@ class PerfumeImage(models.Model):
     
 
     def save(self, *args, **kwargs):
-        if self.image.size > 5 * 1024 * 1024:  
-            self.image = compress_image(self.image)
-        super().save(*args, **kwargs)
\ No newline at end of file
+        # Только что загруженный файл ещё не записан в хранилище; сжимать его будет Celery
+        if self.image and not self.image._committed:
+            self.status = 'pending' if self.image.size > self.COMPRESS_THRESHOLD else 'ready'
+            # Для крупных файлов размеры и превью посчитает задача после сжатия
+            if self.status == 'ready':
+                fill_image_size(self)
+        super().save(*args, **kwargs)
+
+class CatalogCard(models.Model):
+    """Денормализованная карточка доступного парфюма для списков каталога, главной и поиска"""
+    perfume = models.OneToOneField(Perfume, on_delete=models.CASCADE, primary_key=True, 
+                                  related_name='card')
+    name = models.CharField(max_length=255)
+    slug = models.SlugField()
+    image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_placeholder = models.TextField(blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    # Цены объёмов со скидкой: самый дешёвый («от») и самый дорогой; price — цена дешёвого без скидки
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_capacity_price = models.DecimalField(max_digits=10, decimal_places=2)
+    in_stock = models.BooleanField(default=False)
+    capacity_volumes = ArrayField(models.CharField(max_length=20), default=list, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    category_path = models.CharField(max_length=500, db_index=True, 
+                                    help_text="Слаги категорий от корня: /parent/child/")
+    category_filter_slug = models.SlugField(max_length=50)
+    olfactory_family = models.ForeignKey(OlfactoryFamily, on_delete=models.SET_NULL, null=True, 
+                                        blank=True, related_name='+')
+    order = models.PositiveIntegerField(default=0)
+    show_on_hero = models.BooleanField(default=False)
+    show_in_featured = models.BooleanField(default=False)
+    show_in_best_sellers = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'perfume'], name='card_order_idx'),
+            models.Index(fields=['effective_price', 'perfume'], name='card_effective_price_idx'),
+            models.Index(fields=['-max_capacity_price', '-perfume'], name='card_max_price_desc_idx'),
+            GinIndex(fields=['capacity_volumes'], name='card_capacity_volumes_gin'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='card_name_trgm'),
+        ]
+
+
+    def __str__(self):
+        return self.name
+
+
+    @property
+    def available(self):
+        # Карточки существуют только для доступных парфюмов
+        return True
+
+
+    def get_absolute_url(self):
+        return reverse('main:perfume_detail', args=[self.slug])
+
+
+class PerfumeNeighbor(models.Model):
+    """Похожий парфюм по нотам, семье и категории; пересчитывается задачей rebuild_perfume_neighbors"""
+    perfume = models.ForeignKey(Perfume, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Perfume, on_delete=models.CASCADE, related_name='neighbor_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+
+    class Meta:
+        unique_together = ('perfume', 'rank')
+        ordering = ['perfume', 'rank']
+
+
+    def __str__(self):
+        return f"{self.perfume_id} → {self.neighbor_id} ({self.score:.3f})"
+
+
+class ImageVariant(models.Model):
+    """Уменьшенная копия загруженного изображения в современном формате для srcset"""
+    source = models.CharField(max_length=255, db_index=True, 
+                             help_text="Имя исходного файла в хранилище")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    file = models.ImageField(upload_to='variants/%Y/%m/%d', max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+    class Meta:
+        unique_together = ('source', 'width', 'format')
+        ordering = ['source', 'format', 'width']
+
+
+    def __str__(self):
+        return f"{self.source} {self.width}w {self.format}"
+
+
+class ImageBatchJob(models.Model):
+    """Пакетное сжатие изображений галереи из админки; обрабатывается задачами по частям"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+    )
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    image_ids = ArrayField(models.BigIntegerField(), default=list)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+    def __str__(self):
+        return f"Batch #{self.pk}: {self.processed + self.failed}/{self.total}"
+
+
+    def refresh_progress(self):
+        """Пересчитывает прогресс по статусам изображений; статусы же служат точкой возобновления"""
+        counts = dict(
+            PerfumeImage.objects.filter(pk__in=self.image_ids)
+            .order_by().values_list('status').annotate(models.Count('pk'))
+        )
+        now = timezone.now()
+        fields = {'processed': counts.get('ready', 0), 'failed': counts.get('failed', 0), 'updated_at': now}
+        if not counts.get('pending') and not counts.get('processing'):
+            fields.update(status='completed', finished_at=now)
+        # update(), а не save(): несколько частей одной пачки обновляют прогресс параллельно
+        ImageBatchJob.objects.filter(pk=self.pk).update(**fields)
+        for field, value in fields.items():
+            setattr(self, field, value)
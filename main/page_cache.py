@@ -0,0 +1,103 @@
+import re
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .caching import canonical_query_string, get_versions, make_key
+
+
+PAGE_TIMEOUT = 60 * 60 * 24
+
+# Токен в сохранённой странице заменяется на свежий при каждой выдаче
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = '__csrf_token__'
+
+
+class VersionedPageCacheMixin:
+    """
+    Кэш страниц с версионными ключами. Анонимам отдаётся готовый ответ целиком,
+    остальным — фрагмент {% cache %} с тем же ключом (fragment_cache_key в контексте).
+    Наследник перечисляет в get_cache_versions() сущности, от которых зависит страница.
+    Из того же ключа строится ETag, поэтому повторный запрос с If-None-Match получает 304
+    ещё до выборки данных и рендеринга; get_last_modified() добавляет Last-Modified.
+    """
+    page_cache_timeout = PAGE_TIMEOUT
+
+    def get_cache_versions(self):
+        # Без версий ключ зависит только от адреса и живёт до page_cache_timeout
+        return []
+
+    def get_page_cache_key(self):
+        if not hasattr(self, '_page_cache_key'):
+            self._page_cache_key = make_key(
+                'page',
+                self.request.path,
+                canonical_query_string(self.request.GET),
+                self.request.headers.get('HX-Request', ''),
+                *get_versions(*self.get_cache_versions()),
+            )
+        return self._page_cache_key
+
+    def get_last_modified(self):
+        return None
+
+    def get_etag(self):
+        # Шапка страницы зависит от пользователя, поэтому он тоже входит в ETag
+        user = self.request.user
+        digest = make_key('etag', self.get_page_cache_key(), user.pk if user.is_authenticated else '')
+        return '"%s"' % digest.split(':', 1)[1]
+
+    def is_conditional(self):
+        # Непоказанные сообщения должны попасть в свежий ответ
+        return self.request.method in ('GET', 'HEAD') and not len(get_messages(self.request))
+
+    def is_page_cacheable(self):
+        return not self.request.user.is_authenticated
+
+    def dispatch(self, request, *args, **kwargs):
+        # setup() уже заполнил self.request/self.kwargs
+        if not self.is_conditional():
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag()
+        last_modified = self.get_last_modified()
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.cached_dispatch(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+            patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def cached_dispatch(self, request, *args, **kwargs):
+        if not self.is_page_cacheable():
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content.replace(CSRF_PLACEHOLDER, get_token(request)), content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        messages = getattr(request, '_messages', None)
+        if response.status_code == 200 and not response.cookies and not (messages and messages.used):
+            content = CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset))
+            cache.set(key, (content, response['Content-Type']), self.page_cache_timeout)
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment_cache_key'] = self.get_page_cache_key()
+        context['page_cache_timeout'] = self.page_cache_timeout
+        return context
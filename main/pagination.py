@@ -0,0 +1,184 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import models
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+from .caching import canonical_query_string, get_catalog_version, make_key
+
+
+# Параметры, которые не влияют на состав выборки
+PAGINATION_PARAMS = ('page', 'after', 'before')
+
+TOTAL_TIMEOUT = 60 * 60
+
+
+def get_cached_total(params, count):
+    """Общее число результатов для набора фильтров; сбрасывается при смене версии каталога"""
+    key = make_key(
+        'catalog_total', get_catalog_version(), canonical_query_string(params, exclude=PAGINATION_PARAMS)
+    )
+    return cache.get_or_set(key, count, TOTAL_TIMEOUT)
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        if self._count is not None:
+            return self._count
+        return super().count
+
+
+def encode_cursor(values):
+    payload = json.dumps([str(value) if isinstance(value, Decimal) else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _cursor_value(field, value):
+    # Значение курсора уходит прямо в условие WHERE — его тип должен совпадать с полем сортировки
+    if value is None:
+        if field.null:
+            return None
+        raise Http404('Invalid cursor')
+    if field.is_relation:
+        # Первичный ключ-связь (CatalogCard.perfume) сравнивается как id парфюма
+        field = field.target_field
+    if isinstance(field, models.IntegerField):
+        if type(value) is not int:
+            raise Http404('Invalid cursor')
+        return value
+    if isinstance(field, models.DecimalField):
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            raise Http404('Invalid cursor')
+        try:
+            value = Decimal(value)
+        except InvalidOperation:
+            raise Http404('Invalid cursor')
+        if not value.is_finite():
+            raise Http404('Invalid cursor')
+        return value
+    try:
+        return field.to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        raise Http404('Invalid cursor')
+
+
+def decode_cursor(cursor, fields):
+    """Значения курсора, проверенные по полям сортировки fields; битый курсор — 404"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise Http404('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise Http404('Invalid cursor')
+    return [_cursor_value(field, value) for field, value in zip(fields, values)]
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @cached_property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.cursor_for(self.object_list[-1])
+        return None
+
+    @cached_property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.cursor_for(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    """
+    Пагинация по курсору: страница выбирается условием (ключ сортировки, id) > курсор,
+    поэтому любая страница стоит столько же, сколько первая, без OFFSET.
+    ordering — поля сортировки, последнее из них должно быть уникальным (id).
+    """
+
+    def __init__(self, queryset, per_page, ordering, count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self._count = count
+
+    @cached_property
+    def count(self):
+        if self._count is not None:
+            return self._count
+        return self.queryset.count()
+
+    def _fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.ordering]
+
+    def _model_fields(self):
+        opts = self.queryset.model._meta
+        return [opts.pk if name == 'pk' else opts.get_field(name) for name, _ in self._fields()]
+
+    def cursor_for(self, obj):
+        return encode_cursor([getattr(obj, name) for name, _ in self._fields()])
+
+    def _seek(self, values, backwards):
+        # (a, b) > (x, y)  =>  a > x OR (a = x AND b > y), с учётом направления каждого поля.
+        # PostgreSQL ставит NULL последним при ASC и первым при DESC
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self._fields(), values):
+            if descending == backwards:
+                after = Q(pk__in=[]) if value is None else Q(**{f'{name}__gt': value}) | Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__isnull': False}) if value is None else Q(**{f'{name}__lt': value})
+            condition |= equal & after
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    def page(self, after=None, before=None):
+        backwards = bool(before) and not after
+        cursor = before if backwards else after
+        ordering = self.ordering
+        if backwards:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+        queryset = self.queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self._seek(decode_cursor(cursor, self._model_fields()), backwards))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+        return KeysetPage(rows, self, has_next=has_more, has_previous=bool(cursor))
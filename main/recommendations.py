@@ -0,0 +1,110 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+
+from .caching import bump_version, RECOMMENDATIONS
+from .models import Perfume, CategoryClosure, CatalogCard, PerfumeNeighbor
+
+NEIGHBOR_COUNT = 12
+# Сколько строк матрицы сходства считается за раз — ограничивает память на больших каталогах
+BLOCK_SIZE = 512
+
+# Веса признаков: совпадение семьи весит больше одной ноты, категория — меньше
+NOTE_WEIGHT = 1.0
+FAMILY_WEIGHT = 2.0
+CATEGORY_WEIGHT = 0.5
+
+
+def build_feature_matrix():
+    """
+    Матрица «доступный парфюм × признак» (ноты, ольфакторная семья, категория с предками).
+    Возвращает список id парфюмов по строкам и матрицу с нормированными строками.
+    """
+    perfumes = Perfume.objects.filter(available=True).order_by('pk')
+    perfume_ids = list(perfumes.values_list('pk', flat=True))
+    rows = {perfume_id: row for row, perfume_id in enumerate(perfume_ids)}
+    features = {}
+    cells = []
+
+    def add(perfume_id, feature, weight):
+        cells.append((rows[perfume_id], features.setdefault(feature, len(features)), weight))
+
+    # Нота в верхних и базовых нотах — один и тот же признак
+    for field in ('top_notes', 'middle_notes', 'base_notes'):
+        for perfume_id, note_id in perfumes.filter(**{f'{field}__isnull': False}).values_list('pk', field):
+            add(perfume_id, ('note', note_id), NOTE_WEIGHT)
+
+    ancestors = {}
+    for descendant_id, ancestor_id in CategoryClosure.objects.values_list('descendant_id', 'ancestor_id'):
+        ancestors.setdefault(descendant_id, []).append(ancestor_id)
+
+    for perfume_id, family_id, category_id in perfumes.values_list('pk', 'olfactory_family_id', 'category_id'):
+        if family_id is not None:
+            add(perfume_id, ('family', family_id), FAMILY_WEIGHT)
+        for ancestor_id in ancestors.get(category_id, (category_id,)):
+            add(perfume_id, ('category', ancestor_id), CATEGORY_WEIGHT)
+
+    matrix = np.zeros((len(perfume_ids), len(features)), dtype=np.float32)
+    if cells:
+        row_index, column_index, weights = zip(*cells)
+        matrix[list(row_index), list(column_index)] = weights
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return perfume_ids, matrix / norms
+
+
+def compute_neighbors(k=NEIGHBOR_COUNT):
+    """Косинусное сходство блоками строк; для каждого парфюма — k ближайших с ненулевым сходством"""
+    perfume_ids, matrix = build_feature_matrix()
+    count = len(perfume_ids)
+    k = min(k, count - 1)
+    if k <= 0:
+        return []
+
+    neighbors = []
+    for start in range(0, count, BLOCK_SIZE):
+        similarity = matrix[start:start + BLOCK_SIZE] @ matrix.T
+        block_rows = np.arange(similarity.shape[0])
+        similarity[block_rows, block_rows + start] = -1  # сам себе не сосед
+
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarity, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for row, (columns, scores) in enumerate(zip(top, top_scores)):
+            perfume_id = perfume_ids[start + row]
+            rank = 0
+            for column, score in zip(columns, scores):
+                if score <= 0:
+                    break
+                neighbors.append(PerfumeNeighbor(
+                    perfume_id=perfume_id, neighbor_id=perfume_ids[column], rank=rank, score=float(score),
+                ))
+                rank += 1
+    return neighbors
+
+
+def rebuild_perfume_neighbors():
+    neighbors = compute_neighbors()
+    with transaction.atomic():
+        PerfumeNeighbor.objects.all().delete()
+        PerfumeNeighbor.objects.bulk_create(neighbors, batch_size=1000)
+        transaction.on_commit(lambda: bump_version(RECOMMENDATIONS))
+    return len(neighbors)
+
+
+def similar_cards(perfume_ids, limit=4):
+    """
+    Карточки, похожие на указанные парфюмы, — один запрос по таблице соседей.
+    perfume_ids может быть списком или подзапросом (например, купленные пользователем парфюмы).
+    """
+    return CatalogCard.objects.filter(
+        perfume__neighbor_of__perfume__in=perfume_ids,
+    ).exclude(
+        pk__in=perfume_ids,
+    ).annotate(
+        similarity=Max('perfume__neighbor_of__score'),
+    ).order_by('-similarity', 'order', 'pk')[:limit]
@@ -0,0 +1,165 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image
+
+from .utils.image_utils import VARIANT_FORMATS, open_image, supported_variant_formats
+
+# Допустимые ширины: произвольные размеры позволили бы забить кэш мусорными копиями
+RESIZE_WIDTHS = (80, 160, 320, 480, 640, 960, 1280, 1600, 1920, 2560)
+
+# MIME-тип и параметры сохранения; JPEG — запасной формат, который понимают все браузеры
+RESIZE_FORMATS = {
+    'jpeg': ('image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    **VARIANT_FORMATS,
+}
+
+# Отрисовка одной копии блокирует её полосу: одновременные запросы ждут первый, а не рендерят сами
+LOCK_STRIPES = 64
+# LRU по mtime: при попадании файл «трогается» не чаще раза в этот интервал
+TOUCH_INTERVAL = 60 * 60
+# Кэш ужимается до этой доли лимита, чтобы не чистить его после каждой новой копии
+EVICT_TARGET = 0.9
+
+
+def available_formats():
+    return ['jpeg', *supported_variant_formats()]
+
+
+def default_format():
+    return 'webp' if 'webp' in supported_variant_formats() else 'jpeg'
+
+
+def resized_url(source, width, fmt=None):
+    """URL копии изображения; ширина округляется вверх до ближайшей допустимой"""
+    width = next((allowed for allowed in RESIZE_WIDTHS if allowed >= width), RESIZE_WIDTHS[-1])
+    return reverse('main:resized_image', args=[width, fmt or default_format(), source])
+
+
+def _cache_dir():
+    return settings.RESIZE_CACHE_DIR
+
+
+def _rendition_path(source, width, fmt):
+    digest = hashlib.sha256(f'{source}\0{width}\0{fmt}'.encode()).hexdigest()
+    return os.path.join(_cache_dir(), digest[:2], f'{digest}.{fmt}')
+
+
+@contextmanager
+def _file_lock(name, blocking=True):
+    lock_dir = os.path.join(_cache_dir(), '.locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, name), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _open_cached(path):
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    if time.time() - os.fstat(file.fileno()).st_mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+    return file
+
+
+def _render(source, width, fmt):
+    with default_storage.open(source) as file:
+        img = open_image(file, max_dimension=width)
+        # Без увеличения: узкий исходник отдаётся в своей ширине
+        width = min(width, img.width)
+        height = max(1, round(img.height * width / img.width))
+        img = img.resize((width, height), Image.LANCZOS)
+    if fmt == 'jpeg' and img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    return img
+
+
+def open_rendition(source, width, fmt):
+    """
+    Открытый файл копии source шириной width в формате fmt из дискового кэша.
+    Копия рисуется один раз; параллельные запросы той же копии ждут её на файловой блокировке.
+    """
+    path = _rendition_path(source, width, fmt)
+    file = _open_cached(path)
+    if file is not None:
+        return file
+
+    stripe = int(os.path.basename(path)[:8], 16) % LOCK_STRIPES
+    with _file_lock(f'{stripe}.lock'):
+        # Пока ждали, копию мог отрисовать другой запрос
+        file = _open_cached(path)
+        if file is not None:
+            return file
+
+        img = _render(source, width, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Во временный файл и os.replace — читатели не увидят недописанную копию
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.', delete=False) as tmp:
+            img.save(tmp, format=fmt.upper(), **RESIZE_FORMATS[fmt][1])
+        os.replace(tmp.name, path)
+        return open(path, 'rb')
+
+
+def evict(max_bytes=None):
+    """
+    Удаляет давно не запрашивавшиеся копии, пока кэш не уложится в RESIZE_CACHE_MAX_BYTES.
+    Обходит весь каталог кэша, поэтому запускается периодической задачей, а не из запроса.
+    Чистит один процесс за раз; остальные в это время пропускают очистку.
+    """
+    max_bytes = settings.RESIZE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(_cache_dir()):
+        return 0
+    with _file_lock('evict.lock', blocking=False) as locked:
+        if not locked:
+            return 0
+
+        entries, total = [], 0
+        now = time.time()
+        for bucket in os.scandir(_cache_dir()):
+            if bucket.name.startswith('.') or not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                # Временные файлы недавних отрисовок не трогаем, брошенные упавшими процессами — удаляем
+                if entry.name.startswith('.') and now - stat.st_mtime < TOUCH_INTERVAL:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * EVICT_TARGET:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,176 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from .caching import get_versions, CATALOG, CATEGORY
+from .models import Perfume, CatalogCard, Category, OlfactoryFamily, Ingredient
+
+
+SEARCH_CONFIG = 'simple'
+
+
+def normalize_query(query):
+    return ' '.join(re.findall(r'\w+', (query or '').lower()))
+
+
+def build_search_query(query):
+    """Префиксный tsquery: каждое слово запроса должно совпасть с началом слова документа"""
+    terms = normalize_query(query).split()
+    if not terms:
+        return None
+    return SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_perfumes(queryset, query, vector_field='search_vector'):
+    """
+    Фильтрует queryset по полнотекстовому документу и триграммам названия, сортируя по релевантности.
+    Для карточек каталога документ берётся у парфюма: vector_field='perfume__search_vector'.
+    """
+    search_query = build_search_query(query)
+    if search_query is None:
+        return queryset.none()
+    return queryset.annotate(
+        search_rank=SearchRank(F(vector_field), search_query) + TrigramSimilarity('name', query),
+    ).filter(
+        Q(**{vector_field: search_query}) | Q(name__trigram_similar=query)
+    ).order_by('-search_rank', 'order', 'pk')
+
+
+def update_search_vectors(perfume_ids):
+    """Пересобирает tsvector-документ (название, ноты, семья, категория, описание) для указанных парфюмов"""
+    perfumes = Perfume.objects.filter(pk__in=perfume_ids).select_related(
+        'category', 'olfactory_family'
+    ).prefetch_related('top_notes', 'middle_notes', 'base_notes')
+
+    for perfume in perfumes:
+        notes = ' '.join(note.name for note in chain(
+            perfume.top_notes.all(), perfume.middle_notes.all(), perfume.base_notes.all()
+        ))
+        taxonomy = ' '.join(filter(None, [
+            perfume.olfactory_family.name if perfume.olfactory_family else '',
+            perfume.category.name,
+        ]))
+        # update() не вызывает post_save и не трогает updated_at
+        Perfume.objects.filter(pk=perfume.pk).update(search_vector=(
+            SearchVector(Value(perfume.name), weight='A', config=SEARCH_CONFIG) +
+            SearchVector(Value(notes), weight='B', config=SEARCH_CONFIG) +
+            SearchVector(Value(taxonomy), weight='C', config=SEARCH_CONFIG) +
+            SearchVector(Value(perfume.description), weight='D', config=SEARCH_CONFIG)
+        ))
+
+
+# Сколько результатов каждого типа попадает в общую выдачу
+SEARCH_TYPE_LIMITS = {
+    'perfume': 10,
+    'category': 5,
+    'olfactory_family': 5,
+    'ingredient': 5,
+}
+SEARCH_CACHE_SIZE = 256
+PREFIX_BONUS = 1.0
+
+HIT_FIELDS = ('hit_kind', 'hit_id', 'hit_name', 'hit_slug', 'hit_score')
+
+
+class SearchHit(namedtuple('SearchHit', 'kind id name slug score highlights')):
+    """Результат общего поиска; highlights — пары (начало, конец) совпавших фрагментов name"""
+    __slots__ = ()
+
+    @property
+    def url(self):
+        if self.kind == 'perfume':
+            return reverse('main:perfume_detail', args=[self.slug])
+        params = {'category': f'category={self.slug}', 'olfactory_family': f'olfactory_family={self.id}',
+                  'ingredient': f'ingredient={self.id}'}
+        return f"{reverse('main:catalog')}?{params[self.kind]}"
+
+    @property
+    def highlighted_name(self):
+        parts, position = [], 0
+        for start, end in self.highlights:
+            parts.append(format_html('{}<mark>{}</mark>', self.name[position:start], self.name[start:end]))
+            position = end
+        parts.append(format_html('{}', self.name[position:]))
+        return mark_safe(''.join(parts))
+
+
+def highlight_offsets(text, terms):
+    """Отрезки text, с которых начинается одно из слов запроса (без учёта регистра)"""
+    spans = sorted(
+        (match.start(), match.end())
+        for term in terms
+        for match in re.finditer(r'\b' + re.escape(term), text, re.IGNORECASE)
+    )
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
+def _name_score(query):
+    # Общая шкала для всех типов: похожесть названия плюс бонус за совпадение с начала
+    return TrigramSimilarity('name', query) + Case(
+        When(name__istartswith=query, then=Value(PREFIX_BONUS)), default=Value(0.0), output_field=FloatField()
+    )
+
+
+def _hits(queryset, kind, score, slug):
+    return queryset.annotate(
+        hit_kind=Value(kind), hit_id=F('pk'), hit_name=F('name'), hit_slug=slug, hit_score=score,
+    ).values(*HIT_FIELDS).order_by('-hit_score', 'hit_name')[:SEARCH_TYPE_LIMITS[kind]]
+
+
+def _name_filter(query):
+    return Q(name__trigram_similar=query) | Q(name__icontains=query)
+
+
+@lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def _cached_search(query, versions):
+    # versions входит в ключ: после изменения каталога старые записи просто вытесняются
+    search_query = build_search_query(query)
+    perfumes = _hits(
+        CatalogCard.objects.filter(Q(perfume__search_vector=search_query) | Q(name__trigram_similar=query)),
+        'perfume',
+        SearchRank(F('perfume__search_vector'), search_query) + _name_score(query),
+        F('slug'),
+    )
+    categories = _hits(
+        Category.objects.filter(_name_filter(query), show_in_fragrances=True), 'category', _name_score(query), F('slug'),
+    )
+    families = _hits(
+        OlfactoryFamily.objects.filter(_name_filter(query)), 'olfactory_family', _name_score(query), Value(''),
+    )
+    ingredients = _hits(
+        Ingredient.objects.filter(_name_filter(query), show_in_fragrances=True), 'ingredient', _name_score(query),
+        Value(''),
+    )
+
+    terms = query.split()
+    return tuple(
+        SearchHit(
+            row['hit_kind'], row['hit_id'], row['hit_name'], row['hit_slug'], row['hit_score'],
+            highlight_offsets(row['hit_name'], terms),
+        )
+        for row in perfumes.union(categories, families, ingredients, all=True).order_by('-hit_score')
+    )
+
+
+def unified_search(query):
+    """
+    Парфюмы, категории, семейства и ингредиенты одним UNION-запросом с общей оценкой релевантности.
+    Возвращает кортеж SearchHit по убыванию оценки; популярные запросы обслуживаются из LRU.
+    """
+    query = normalize_query(query)
+    if not query:
+        return ()
+    return _cached_search(query, tuple(get_versions((CATALOG,), (CATEGORY,))))
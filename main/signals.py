@@ -0,0 +1,242 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Perfume, PerfumeCapacity, PerfumeImage, Capacity, Category, Ingredient, \
+    OlfactoryNote, OlfactoryFamily, CatalogCard, ImageVariant
+from .caching import bump_catalog_version, bump_version, bump_versions, PERFUME, CATEGORY, CAPACITY, HOME, \
+    AUTOCOMPLETE
+from .autocomplete import autocomplete_index
+from .cards import refresh_catalog_cards
+from .closure import insert_category, move_category
+from .facets import facet_index
+from .search import update_search_vectors
+from .images import IMAGE_FIELDS, delete_variants
+from .tasks import schedule_recommendations_rebuild, generate_image_variants, process_perfume_image
+
+
+def on_homepage(perfume_ids):
+    return CatalogCard.objects.filter(pk__in=perfume_ids).filter(
+        Q(show_on_hero=True) | Q(show_in_featured=True) | Q(show_in_best_sellers=True)
+    ).exists()
+
+
+def catalog_changed(perfume_ids=(), search=False, structure=False, namespaces=(), features=False):
+    """
+    После коммита обновляет производные данные каталога и поднимает его версию.
+    structure=True — изменились категории/ингредиенты, карточки и индекс фасетов строятся заново.
+    namespaces — дополнительные пространства версий страничного кэша (категории, объёмы).
+    features=True — изменились ноты/семья/категория, рекомендации пересчитываются задачей Celery.
+    """
+    perfume_ids = list(perfume_ids)
+
+    def apply():
+        if search and perfume_ids:
+            update_search_vectors(perfume_ids)
+        # Главную сбрасываем, если парфюм был на ней до изменения или оказался после
+        homepage = structure or on_homepage(perfume_ids)
+        refresh_catalog_cards(None if structure else perfume_ids)
+        homepage = homepage or on_homepage(perfume_ids)
+
+        version = bump_catalog_version()
+        bump_versions(PERFUME, perfume_ids)
+        for namespace in namespaces:
+            bump_version(namespace)
+        if homepage:
+            bump_version(HOME)
+
+        if structure:
+            facet_index.invalidate()
+        else:
+            facet_index.refresh_perfumes(perfume_ids, version)
+
+        if features:
+            schedule_recommendations_rebuild()
+
+    transaction.on_commit(apply)
+
+
+# Поля парфюма, из которых строятся признаки рекомендаций (ноты отслеживает perfume_notes_changed)
+PERFUME_FEATURE_FIELDS = ('available', 'category_id', 'olfactory_family_id')
+
+
+@receiver(pre_save, sender=Perfume)
+def perfume_remember_features(sender, instance, **kwargs):
+    instance._previous_features = (
+        Perfume.objects.filter(pk=instance.pk).values_list(*PERFUME_FEATURE_FIELDS).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Perfume)
+def perfume_saved(sender, instance, created, **kwargs):
+    # Правка цены, флагов или порядка не трогает соседей — пересчёт только при смене признаков
+    features = tuple(getattr(instance, field) for field in PERFUME_FEATURE_FIELDS)
+    changed = created or getattr(instance, '_previous_features', None) != features
+    catalog_changed([instance.pk], search=True, features=changed)
+
+
+@receiver(post_delete, sender=Perfume)
+def perfume_deleted(sender, instance, **kwargs):
+    catalog_changed([instance.pk], features=True)
+
+
+@receiver(post_save, sender=PerfumeCapacity)
+@receiver(post_delete, sender=PerfumeCapacity)
+def perfume_capacity_changed(sender, instance, **kwargs):
+    catalog_changed([instance.perfume_id])
+
+
+@receiver(post_save, sender=PerfumeImage)
+@receiver(post_delete, sender=PerfumeImage)
+def perfume_image_changed(sender, instance, **kwargs):
+    # Галерея есть только на странице товара, карточки не меняются
+    perfume_id = instance.product_id
+    transaction.on_commit(lambda: bump_version(PERFUME, perfume_id))
+
+
+@receiver(post_save, sender=PerfumeImage)
+def perfume_image_saved(sender, instance, **kwargs):
+    if instance.status == 'pending':
+        image_id = instance.pk
+        transaction.on_commit(lambda: process_perfume_image.delay(image_id))
+
+
+@receiver(post_save, sender=Capacity)
+@receiver(post_delete, sender=Capacity)
+def capacity_changed(sender, instance, **kwargs):
+    catalog_changed(structure=True, namespaces=[CAPACITY])
+
+
+@receiver(m2m_changed, sender=Perfume.capacities.through)
+def perfume_capacities_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        catalog_changed([instance.pk])
+    elif pk_set:
+        catalog_changed(pk_set)
+    else:
+        catalog_changed(structure=True, namespaces=[CAPACITY])
+
+
+@receiver(m2m_changed, sender=Perfume.top_notes.through)
+@receiver(m2m_changed, sender=Perfume.middle_notes.through)
+@receiver(m2m_changed, sender=Perfume.base_notes.through)
+def perfume_notes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        catalog_changed([instance.pk], search=True, features=True)
+    elif pk_set:
+        catalog_changed(pk_set, search=True, features=True)
+
+
+def note_perfume_ids(note):
+    return list(Perfume.objects.filter(
+        Q(top_notes=note) | Q(middle_notes=note) | Q(base_notes=note)
+    ).values_list('pk', flat=True).distinct())
+
+
+@receiver(post_save, sender=OlfactoryNote)
+def olfactory_note_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    catalog_changed(note_perfume_ids(instance), search=True)
+
+
+@receiver(pre_delete, sender=OlfactoryNote)
+def olfactory_note_deleted(sender, instance, **kwargs):
+    # Связи с парфюмами удаляются без m2m_changed — запоминаем парфюмы, пока связи ещё есть
+    catalog_changed(note_perfume_ids(instance), search=True, features=True)
+
+
+@receiver(post_delete, sender=OlfactoryFamily)
+def olfactory_family_deleted(sender, instance, **kwargs):
+    catalog_changed(structure=True, namespaces=[CATEGORY], features=True)
+
+
+@receiver(post_save, sender=OlfactoryFamily)
+def olfactory_family_saved(sender, instance, created, **kwargs):
+    perfume_ids = [] if created else instance.perfumes.values_list('pk', flat=True)
+    catalog_changed(perfume_ids, search=True, namespaces=[CATEGORY])
+
+
+@receiver(pre_save, sender=Category)
+def category_remember_parent(sender, instance, **kwargs):
+    instance._previous_parent_id = (
+        Category.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if created:
+        insert_category(instance)
+    elif instance.parent_id != getattr(instance, '_previous_parent_id', instance.parent_id):
+        move_category(instance)
+    perfume_ids = [] if created else instance.perfumes.values_list('pk', flat=True)
+    catalog_changed(perfume_ids, search=True, structure=True, namespaces=[CATEGORY], features=True)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def catalog_structure_changed(sender, instance, **kwargs):
+    catalog_changed(structure=True, namespaces=[CATEGORY])
+
+
+AUTOCOMPLETE_KINDS = {
+    Perfume: 'perfume',
+    Category: 'category',
+    OlfactoryFamily: 'olfactory_family',
+    Ingredient: 'ingredient',
+    OlfactoryNote: 'note',
+}
+
+
+@receiver(post_save, sender=Perfume)
+@receiver(post_delete, sender=Perfume)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=OlfactoryFamily)
+@receiver(post_delete, sender=OlfactoryFamily)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=OlfactoryNote)
+@receiver(post_delete, sender=OlfactoryNote)
+def autocomplete_entry_changed(sender, instance, **kwargs):
+    kind, pk = AUTOCOMPLETE_KINDS[sender], instance.pk
+
+    def apply():
+        autocomplete_index.refresh(kind, [pk], bump_version(AUTOCOMPLETE))
+
+    transaction.on_commit(apply)
+
+
+def image_field_receivers(field_name):
+    def saved(sender, instance, **kwargs):
+        # Сжимаемое в фоне изображение получит варианты после обработки (process_perfume_image)
+        if getattr(instance, 'status', 'ready') != 'ready':
+            return
+        source = getattr(instance, field_name).name
+        if source and not ImageVariant.objects.filter(source=source).exists():
+            transaction.on_commit(lambda: generate_image_variants.delay(source))
+
+    def deleted(sender, instance, **kwargs):
+        source = getattr(instance, field_name).name
+        if source:
+            transaction.on_commit(lambda: delete_variants(source))
+
+    return saved, deleted
+
+
+for app_label, model_name, field_name in IMAGE_FIELDS:
+    model = apps.get_model(app_label, model_name)
+    saved, deleted = image_field_receivers(field_name)
+    uid = f'image_variants:{app_label}.{model_name}.{field_name}'
+    post_save.connect(saved, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=uid)
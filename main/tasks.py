@@ -0,0 +1,58 @@
+from celery import shared_task
+from django.core.cache import cache
+from django.db import transaction
+
+from .images import batch_chunks, generate_variants, process_image_batch_chunk, \
+    process_perfume_image as compress_perfume_image
+from .recommendations import rebuild_perfume_neighbors
+from .resize import evict
+
+RECOMMENDATIONS_PENDING_KEY = 'recommendations_rebuild_pending'
+
+
+def schedule_recommendations_rebuild():
+    # Серия правок в админке ставит в очередь одну задачу, а не по задаче на каждое сохранение
+    if cache.add(RECOMMENDATIONS_PENDING_KEY, 1, 10 * 60):
+        refresh_recommendations.delay()
+
+
+@shared_task
+def refresh_recommendations():
+    cache.delete(RECOMMENDATIONS_PENDING_KEY)
+    return rebuild_perfume_neighbors()
+
+
+@shared_task
+def generate_image_variants(source, force=False):
+    return generate_variants(source, force=force)
+
+
+@shared_task
+def process_perfume_image(image_id):
+    return compress_perfume_image(image_id)
+
+
+@shared_task
+def evict_resized_images():
+    return evict()
+
+
+def enqueue_image_batch(job, image_ids=None):
+    """Ставит пакет в очередь частями после коммита; image_ids — при возобновлении только оставшиеся"""
+    chunks = batch_chunks(job.image_ids if image_ids is None else image_ids)
+    if not chunks:
+        job.refresh_progress()
+        return
+
+    def enqueue():
+        for chunk in chunks:
+            compress_image_batch_chunk.delay(job.pk, chunk)
+
+    transaction.on_commit(enqueue)
+
+
+# acks_late: если воркер умрёт посреди части, брокер отдаст её другому воркеру
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def compress_image_batch_chunk(self, job_id, image_ids):
+    redelivered = bool((self.request.delivery_info or {}).get('redelivered'))
+    return process_image_batch_chunk(job_id, image_ids, redelivered=redelivered)
@@ -0,0 +1,63 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from main.images import build_srcsets
+from main.resize import resized_url as build_resized_url
+
+register = template.Library()
+
+DEFAULT_SIZES = '(max-width: 576px) 50vw, (max-width: 992px) 33vw, 300px'
+
+
+def image_attrs(image):
+    """width/height и фон-превью из полей <поле>_width, <поле>_height, <поле>_placeholder модели"""
+    name = image.field.name
+    width = getattr(image.instance, f'{name}_width', None)
+    height = getattr(image.instance, f'{name}_height', None)
+    placeholder = getattr(image.instance, f'{name}_placeholder', '')
+    attrs = {'width': width, 'height': height} if width and height else {}
+    if placeholder:
+        attrs['style'] = f'background: center / cover no-repeat url("{placeholder}")'
+        # У прозрачных изображений превью просвечивало бы после загрузки
+        attrs['onload'] = "this.style.background='none'"
+    return attrs
+
+
+@register.simple_tag
+def responsive_image(image, alt='', css_class='', sizes=DEFAULT_SIZES, loading='lazy'):
+    """
+    <picture> с вариантами AVIF/WebP через srcset/sizes и исходником в <img> как запасным вариантом.
+    Пока варианты не построены, выводится обычный <img>.
+    Сохранённые размеры резервируют место под изображение, размытое превью видно до его загрузки.
+    """
+    if not image:
+        return ''
+    img = format_html('<img{}>', flatatt({
+        'src': image.url, 'alt': alt, 'class': css_class, 'loading': loading, 'decoding': 'async',
+        **image_attrs(image),
+    }))
+    srcsets = build_srcsets(image.name)
+    if not srcsets:
+        return img
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">', ((mime, srcset, sizes) for mime, srcset in srcsets)
+    )
+    return format_html('<picture>{}{}</picture>', sources, img)
+
+
+@register.simple_tag
+def resized_url(image, width, fmt=None):
+    """URL копии изображения нужной ширины, которая рисуется по первому запросу"""
+    if not image:
+        return ''
+    return build_resized_url(image.name, width, fmt)
+
+
+@register.simple_tag
+def resized_srcset(image, widths, fmt=None):
+    """srcset из копий перечисленных через запятую ширин"""
+    if not image:
+        return ''
+    return ', '.join(f'{build_resized_url(image.name, int(width), fmt)} {width}w' for width in widths.split(','))
+
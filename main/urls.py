@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import CatalogView, PerfumeDetailView, HomeView, about
+from .views import CatalogView, PerfumeDetailView, HomeView, about, autocomplete, resized_image
 from .context_processors import search_results
 
 app_name = 'main'
@@ -10,4 +10,6 @@ urlpatterns = [
     path('perfume/<slug:slug>/', PerfumeDetailView.as_view(), name='perfume_detail'),
     path('about/', about, name='about'),
     path('results/', search_results, name='results'),
+    path('autocomplete/', autocomplete, name='autocomplete'),
+    path('resize/<int:width>/<str:fmt>/<path:path>', resized_image, name='resized_image'),
 ]
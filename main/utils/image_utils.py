@@ -1,14 +1,118 @@
+import base64
 from io import BytesIO
-from PIL import Image
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from PIL import ExifTags, Image, ImageFilter, ImageOps
+from django.core.files.base import ContentFile
 
 
-def compress_image(image, quality=85):
-    img = Image.open(image)
-    if img.mode != 'RGB':
+# Больше этой стороны исходники не хранятся: сайт не показывает изображения крупнее
+MAX_DIMENSION = 2560
+
+
+def has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def compress_image(file, max_dimension=MAX_DIMENSION, quality=85):
+    """
+    Уменьшает изображение до max_dimension по большей стороне и пережимает его.
+    JPEG сразу декодируется в уменьшенном масштабе (draft), поэтому полное разрешение
+    не попадает в память. Изображения с прозрачностью остаются PNG, остальные становятся JPEG.
+    Возвращает (ContentFile, расширение).
+    """
+    img = Image.open(file)
+    img.draft('RGB', (max_dimension, max_dimension))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=2.0)
+
+    output = BytesIO()
+    if has_alpha(img):
+        img.convert('RGBA').save(output, format='PNG', optimize=True)
+        extension = '.png'
+    else:
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        extension = '.jpg'
+    return ContentFile(output.getvalue()), extension
+
+
+# Сторона размытого превью: растягивается браузером, пока грузится само изображение
+PLACEHOLDER_SIZE = 16
+
+
+def image_size(file):
+    """
+    Размеры изображения с учётом EXIF-поворота. Читается только заголовок, файл не декодируется,
+    поэтому размеры можно брать прямо в запросе админки.
+    """
+    img = Image.open(file)
+    width, height = img.size
+    # getexif() у PNG без EXIF в заголовке декодирует весь файл в поисках чанка eXIf
+    if img.format != 'PNG' or 'exif' in img.info:
+        # Браузер поворачивает фото по EXIF, значит и место под него резервируется повёрнутым
+        if img.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return width, height
+
+
+def make_placeholder(img):
+    """Крошечное размытое превью уже открытого изображения в виде data URI"""
+    img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+    img = img.filter(ImageFilter.GaussianBlur(1))
+
+    fmt = 'webp' if 'webp' in supported_variant_formats() else 'png'
+    output = BytesIO()
+    img.save(output, format=fmt.upper(), quality=40)
+    return f'data:image/{fmt};base64,' + base64.b64encode(output.getvalue()).decode()
+
+
+def image_metadata(file):
+    """
+    Размеры и размытое превью. Декодируется уменьшенная копия (draft), поэтому крупный JPEG
+    читается быстро, но PNG и WebP декодируются целиком — вызывается только в фоне.
+    """
+    width, height = image_size(file)
+    img = Image.open(file)
+    img.draft('RGB', (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+    placeholder = make_placeholder(ImageOps.exif_transpose(img))
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return width, height, placeholder
+
+
+# MIME-тип и параметры сохранения для форматов вариантов
+VARIANT_FORMATS = {
+    'avif': ('image/avif', {'quality': 60}),
+    'webp': ('image/webp', {'quality': 80, 'method': 6}),
+}
+
+
+def supported_variant_formats():
+    """Форматы вариантов, которые умеет сохранять установленный Pillow (AVIF есть не во всех сборках)"""
+    Image.init()
+    return [fmt for fmt in VARIANT_FORMATS if fmt.upper() in Image.SAVE]
+
+
+def open_image(file, max_dimension=None):
+    img = Image.open(file)
+    if max_dimension:
+        img.draft('RGB', (max_dimension, max_dimension))
+    img = ImageOps.exif_transpose(img)
+    # Прозрачность сохраняем: и WebP, и AVIF поддерживают альфа-канал
+    if has_alpha(img) or (img.mode == 'RGB' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'RGBA'):
         img = img.convert('RGB')
+    return img
+
+
+def render_variant(img, width, fmt):
+    """Уменьшенная копия заданной ширины в формате fmt; возвращает (bytes, высота)"""
+    height = max(1, round(img.height * width / img.width))
+    resized = img.resize((width, height), Image.LANCZOS)
     output = BytesIO()
-    img.save(output, format='JPEG', quality=quality)
-    output.seek(0)
-    return InMemoryUploadedFile(output, 'ImageField', 
-                                image.name, 'image/jpeg', output.getbuffer().nbytes, None)
+    resized.save(output, format=fmt.upper(), **VARIANT_FORMATS[fmt][1])
+    return output.getvalue(), height
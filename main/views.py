@@ -1,75 +1,103 @@
+from django.conf import settings
 from django.views.generic import ListView, DetailView
 from .models import Perfume, Category, Capacity, PerfumeCapacity, \
-      OlfactoryNote, OlfactoryFamily, Ingredient
+      OlfactoryNote, OlfactoryFamily, Ingredient, CatalogCard
 from django.shortcuts import render
-from django.db.models import Q
-
-
-class CatalogView(ListView):
-    model = Perfume
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+from PIL import Image, UnidentifiedImageError
+from django.db.models import Q, Max
+from .facets import facet_index, get_facet_selections, parse_price, PRICE_BUCKETS
+from .search import search_perfumes
+from .autocomplete import autocomplete_index
+from .resize import RESIZE_FORMATS, RESIZE_WIDTHS, available_formats, open_rendition
+from .recommendations import similar_cards
+from .caching import canonical_query_string, PERFUME, CATEGORY, CAPACITY, HOME, CATALOG, RECOMMENDATIONS, \
+    IMAGES
+from .page_cache import VersionedPageCacheMixin
+from .pagination import CachedCountPaginator, KeysetPaginator, get_cached_total, PAGINATION_PARAMS
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Последнее поле сортировки уникально — нужно для стабильного курсора
+CATALOG_ORDERINGS = {
+    'price_asc': ('effective_price', 'pk'),
+    'price_desc': ('-max_capacity_price', '-pk'),
+}
+CATALOG_DEFAULT_ORDERING = ('order', 'pk')
+
+
+class CatalogView(VersionedPageCacheMixin, ListView):
+    model = CatalogCard
     template_name = 'main/product/catalog.html'
     context_object_name = 'perfumes'
     paginate_by = 20
+    keyset_pagination = getattr(settings, 'CATALOG_KEYSET_PAGINATION', False)
+
+    def get_cache_versions(self):
+        # Версия каталога меняется при любом изменении карточек
+        return [(CATALOG,), (CATEGORY,), (CAPACITY,), (IMAGES,)]
 
     def get_queryset(self):
+        # Карточки есть только у доступных парфюмов
         queryset = super().get_queryset()
-        queryset = queryset.filter(available=True).order_by('order')
 
-        category_slugs = self.request.GET.getlist('category')
-        capacity_volumes = self.request.GET.getlist('capacity')
-        min_price = self.request.GET.get('min_price')
-        max_price = self.request.GET.get('max_price')
         sort = self.request.GET.get('sort')
         search_query = self.request.GET.get('search', '')
-        olfactory_family = self.request.GET.get('olfactory_family')
-        ingredient_id = self.request.GET.get('ingredient')
-
-        if category_slugs:
-            subcategory_slugs = Category.objects.filter(parent__slug__in=category_slugs).values_list('slug', flat=True)
-            category_slugs.extend(subcategory_slugs)
-            queryset = queryset.filter(category__slug__in=category_slugs)
-        else:
-            queryset = queryset.all()
-
-        if capacity_volumes:
-            queryset = queryset.filter(
-                Q(capacities__volume__in=capacity_volumes) & Q(capacities__perfumecapacity__available=True)
-            ).distinct()
-
-        if min_price:
-            queryset = queryset.filter(price__gte=min_price)
-
-        if max_price:
-            queryset = queryset.filter(price__lte=max_price)
-
-        if olfactory_family:
-            queryset = queryset.filter(olfactory_family__id=olfactory_family)
-
-        if ingredient_id:
-            try:
-                ingredient = Ingredient.objects.get(id=ingredient_id)
-                queryset = queryset.filter(olfactory_family=ingredient.olfactory_family)
-            except Ingredient.DoesNotExist:
-                queryset = queryset.none()
-
-        if sort == 'on_sale':
-            queryset = queryset.filter(discount__gt=0)
-
-        if sort == 'price_asc':
-            queryset = queryset.order_by('price')
-        elif sort == 'price_desc':
-            queryset = queryset.order_by('-price')
+        self.search_query = search_query
+        self.ordering = CATALOG_ORDERINGS.get(sort, CATALOG_DEFAULT_ORDERING)
+
+        # Категории, объёмы, семейства, ингредиент и цена считаются в индексе фасетов
+        self.facets = facet_index.query(
+            get_facet_selections(self.request.GET),
+            min_price=parse_price(self.request.GET.get('min_price')),
+            max_price=parse_price(self.request.GET.get('max_price')),
+            on_sale=sort == 'on_sale',
+        )
+        # Без фильтров индекс вернул весь каталог — список id в запросе не нужен
+        if self.facets.filtered:
+            queryset = queryset.filter(pk__in=self.facets.ids)
 
         if search_query:
-            queryset = queryset.filter(
-                Q(name__icontains=search_query) |
-                Q(top_notes__name__icontains=search_query) |
-                Q(middle_notes__name__icontains=search_query) |
-                Q(base_notes__name__icontains=search_query)
-            ).distinct()
+            queryset = search_perfumes(queryset, search_query, vector_field='perfume__search_vector')
+
+        # Без явной сортировки поиск оставляет порядок по релевантности
+        if sort in CATALOG_ORDERINGS or not search_query:
+            queryset = queryset.order_by(*self.ordering)
 
         return queryset
 
+    def uses_keyset_pagination(self):
+        # Ранжированный поиск не даёт стабильного ключа для курсора
+        if self.search_query:
+            return False
+        return self.keyset_pagination or 'after' in self.request.GET or 'before' in self.request.GET
+
+    def get_total_count(self, queryset):
+        if not self.search_query:
+            return len(self.facets.ids)
+        return get_cached_total(self.request.GET, queryset.count)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CachedCountPaginator(
+            queryset, per_page, count=self.get_total_count(queryset),
+            orphans=orphans, allow_empty_first_page=allow_empty_first_page, **kwargs
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.uses_keyset_pagination():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(
+            queryset, page_size, self.ordering, count=self.get_total_count(queryset)
+        )
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         category_slugs = self.request.GET.getlist('category')
@@ -85,30 +113,46 @@ class CatalogView(ListView):
         context['categories'] = Category.objects.filter(parent=None)
         context['capacities'] = Capacity.objects.all()
         context['olfactory_families'] = OlfactoryFamily.objects.all()
+        for category in context['categories']:
+            category.facet_count = self.facets.count_for('category', category.slug)
+        for capacity in context['capacities']:
+            capacity.facet_count = self.facets.count_for('capacity', capacity.volume)
+        for family in context['olfactory_families']:
+            family.facet_count = self.facets.count_for('olfactory_family', family.id)
+        context['price_ranges'] = [
+            {'slug': slug, 'count': self.facets.count_for('price_range', slug)}
+            for slug, low, high in PRICE_BUCKETS
+        ]
+        context['selected_price_ranges'] = self.request.GET.getlist('price_range')
         context['selected_categories'] = category_slugs
         context['selected_capacities'] = self.request.GET.getlist('capacity')
         context['selected_olfactory_family'] = self.request.GET.get('olfactory_family')
         context['selected_ingredient'] = self.request.GET.get('ingredient')
         context['selected_category'] = selected_category  # Добавляем выбранную категорию
+        context['keyset_pagination'] = self.uses_keyset_pagination()
+        context['pagination_query'] = canonical_query_string(self.request.GET, exclude=PAGINATION_PARAMS)
 
         return context
 
 
-class HomeView(ListView):
-    model = Perfume
+class HomeView(VersionedPageCacheMixin, ListView):
+    model = CatalogCard
     template_name = 'main/index.html'
     context_object_name = 'perfumes'
 
+    def get_cache_versions(self):
+        return [(HOME,), (CATEGORY,), (IMAGES,)]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        hero_product = Perfume.objects.filter(show_on_hero=True).first()
+        hero_product = CatalogCard.objects.filter(show_on_hero=True).order_by('order', 'pk').first()
         context['hero_product'] = hero_product
         
-        featured_products = Perfume.objects.filter(show_in_featured=True, available=True).order_by('order')
+        featured_products = CatalogCard.objects.filter(show_in_featured=True).order_by('order', 'pk')
         context['featured_products'] = featured_products
         
-        best_sellers = Perfume.objects.filter(show_in_best_sellers=True, available=True).order_by('order')
+        best_sellers = CatalogCard.objects.filter(show_in_best_sellers=True).order_by('order', 'pk')
         context['best_sellers'] = best_sellers
         
         filter_categories = Category.objects.filter(show_in_filters=True)
@@ -117,13 +161,31 @@ class HomeView(ListView):
         return context
 
 
-class PerfumeDetailView(DetailView):
+class PerfumeDetailView(VersionedPageCacheMixin, DetailView):
     model = Perfume
     template_name = 'main/product/detail.html'
     context_object_name = 'perfume'
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
 
+    def get_stamp(self):
+        # id и время последнего изменения парфюма и его объёмов — одним запросом
+        if not hasattr(self, '_stamp'):
+            self._stamp = Perfume.objects.filter(slug=self.kwargs['slug']).annotate(
+                capacities_updated_at=Max('perfumecapacity__updated_at'),
+            ).values('pk', 'updated_at', 'capacities_updated_at').first() or {}
+        return self._stamp
+
+    def get_cache_versions(self):
+        # Карточки похожих товаров показывают цену и наличие других парфюмов — отсюда CATALOG
+        return [
+            (PERFUME, self.get_stamp().get('pk')), (CATEGORY,), (CAPACITY,), (CATALOG,), (RECOMMENDATIONS,), (IMAGES,),
+        ]
+
+    def get_last_modified(self):
+        stamp = self.get_stamp()
+        return max(filter(None, [stamp.get('updated_at'), stamp.get('capacities_updated_at')]), default=None)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         perfume = self.object
@@ -142,10 +204,42 @@ class PerfumeDetailView(DetailView):
             context['top_notes'] = perfume.top_notes.all()
             context['middle_notes'] = perfume.middle_notes.all()
             context['base_notes'] = perfume.base_notes.all()
-            
+
+        # Похожие парфюмы заранее посчитаны задачей refresh_recommendations
+        context['related_products'] = similar_cards([perfume.pk])
+
         return context
 
 
 def about(request):
     return render(request, 'main/about.html')
-    
\ No newline at end of file
+    
+
+
+def autocomplete(request):
+    query = request.GET.get('q', '').strip()
+    return JsonResponse({'query': query, 'results': autocomplete_index.suggest(query)})
+
+
+# Имя исходника уникально для каждой загрузки, поэтому копию можно кэшировать «навсегда»
+RESIZED_IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+@require_GET
+def resized_image(request, width, fmt, path):
+    if width not in RESIZE_WIDTHS or fmt not in available_formats():
+        raise Http404
+    try:
+        if not default_storage.exists(path):
+            raise Http404
+        file = open_rendition(path, width, fmt)
+    except (SuspiciousFileOperation, FileNotFoundError, UnidentifiedImageError, Image.DecompressionBombError):
+        # FileNotFoundError — исходник удалили между проверкой и открытием
+        raise Http404
+    except OSError:
+        # Переполненный диск или права на RESIZE_CACHE_DIR — это не отсутствующая картинка
+        logger.exception(f"Cannot render resized image: path={path}, width={width}, format={fmt}")
+        raise
+    response = FileResponse(file, content_type=RESIZE_FORMATS[fmt][0])
+    patch_cache_control(response, public=True, max_age=RESIZED_IMAGE_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,259 @@
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LocalLRU:
+    """Ограниченный LRU внутри процесса; значения хранятся сериализованными, чтобы их нельзя было изменить по ссылке"""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            expires_at, payload = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(payload)
+
+    def set(self, key, value, timeout=None):
+        # L1 живёт не дольше своего короткого TTL и не дольше записи в Redis
+        ttl = self.timeout if timeout is None else min(self.timeout, timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredRedisCache(RedisCache):
+    """
+    Двухуровневый кэш: LRU в памяти процесса (L1) перед общим Redis (L2).
+    Любая запись или удаление публикуется в канал Redis, и остальные процессы выбрасывают ключ из L1.
+    get_or_set вычисляет отсутствующее значение один раз на весь кластер: остальные ждут под блокировкой.
+
+    Дополнительные OPTIONS: L1_MAX_ENTRIES, L1_TIMEOUT (секунды), INVALIDATION_CHANNEL,
+    LOCK_TIMEOUT (сколько ждать чужого вычисления), LOCK_POLL_INTERVAL.
+    """
+
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS') or {})
+        max_entries = options.pop('L1_MAX_ENTRIES', 1000)
+        l1_timeout = options.pop('L1_TIMEOUT', 5)
+        self._channel = options.pop('INVALIDATION_CHANNEL', 'cache-invalidation')
+        self._lock_timeout = options.pop('LOCK_TIMEOUT', 10)
+        self._lock_poll_interval = options.pop('LOCK_POLL_INTERVAL', 0.05)
+        super().__init__(server, {**params, 'OPTIONS': options})
+
+        self._local = LocalLRU(max_entries, l1_timeout)
+        self._origin = None
+        self._listener_pid = None
+        self._listener_guard = threading.Lock()
+        # Потоки одного процесса, ждущие один ключ, встают в общую очередь
+        self._flight_locks = [threading.Lock() for _ in range(64)]
+
+    # Инвалидация L1 в остальных процессах
+
+    def _ensure_listener(self):
+        # gunicorn форкает воркеры после импорта настроек — слушатель нужен в каждом процессе
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_guard:
+            if self._listener_pid == pid:
+                return
+            self._local.clear()
+            # Свои сообщения процесс пропускает; у форка должен быть свой идентификатор
+            self._origin = uuid.uuid4().hex.encode()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+            self._listener_pid = pid
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._cache.get_client(write=False).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    origin, _, payload = message['data'].partition(b'|')
+                    if origin == self._origin:
+                        continue
+                    if payload == b'*':
+                        self._local.clear()
+                    else:
+                        for key in payload.decode().split('\n'):
+                            self._local.delete(key)
+            except Exception:
+                # Пока подписки нет, L1 может отстать — очищаем его и переподключаемся
+                logger.exception('Cache invalidation listener failed, reconnecting')
+                self._local.clear()
+                time.sleep(1)
+
+    def _invalidate(self, keys):
+        # keys=None — сбросить L1 целиком
+        for key in keys or ():
+            self._local.delete(key)
+        payload = b'*' if keys is None else '\n'.join(keys).encode()
+        self._ensure_listener()
+        try:
+            self._cache.get_client(write=True).publish(self._channel, self._origin + b'|' + payload)
+        except Exception:
+            logger.exception('Failed to publish cache invalidation')
+
+    def _l1_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        return self._local.timeout if timeout is None else timeout
+
+    # Чтение
+
+    def get(self, key, default=None, version=None):
+        self._ensure_listener()
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self._local.get(full_key)
+        if value is not _MISSING:
+            return value
+        value = self._cache.get(full_key, _MISSING)
+        if value is _MISSING:
+            return default
+        self._local.set(full_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._ensure_listener()
+        full_keys = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found, missing = {}, []
+        for full_key, key in full_keys.items():
+            value = self._local.get(full_key)
+            if value is _MISSING:
+                missing.append(full_key)
+            else:
+                found[key] = value
+        if missing:
+            for full_key, value in self._cache.get_many(missing).items():
+                self._local.set(full_key, value)
+                found[full_keys[full_key]] = value
+        return found
+
+    # Запись
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        full_key = self.make_and_validate_key(key, version=version)
+        self._cache.set(full_key, value, self.get_backend_timeout(timeout))
+        self._invalidate([full_key])
+        self._local.set(full_key, value, self._l1_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        full_key = self.make_and_validate_key(key, version=version)
+        added = self._cache.add(full_key, value, self.get_backend_timeout(timeout))
+        if added:
+            self._invalidate([full_key])
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        full_data = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        self._cache.set_many(full_data, self.get_backend_timeout(timeout))
+        self._invalidate(list(full_data))
+        return []
+
+    def incr(self, key, delta=1, version=None):
+        self._ensure_listener()
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self._cache.incr(full_key, delta)
+        self._invalidate([full_key])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        return self._cache.touch(full_key, self.get_backend_timeout(timeout))
+
+    def delete(self, key, version=None):
+        self._ensure_listener()
+        full_key = self.make_and_validate_key(key, version=version)
+        deleted = self._cache.delete(full_key)
+        self._invalidate([full_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self._ensure_listener()
+        full_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        self._cache.delete_many(full_keys)
+        self._invalidate(full_keys)
+
+    def clear(self):
+        self._ensure_listener()
+        result = self._cache.clear()
+        self._invalidate(None)
+        self._local.clear()
+        return result
+
+    # Защита от лавины запросов на холодный ключ
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, _MISSING, version=version)
+        if value is not _MISSING:
+            return value
+        if not callable(default):
+            return super().get_or_set(key, default, timeout=timeout, version=version)
+
+        full_key = self.make_and_validate_key(key, version=version)
+        with self._flight_locks[hash(full_key) % len(self._flight_locks)]:
+            value = self.get(key, _MISSING, version=version)
+            if value is not _MISSING:
+                return value
+
+            lock = self._cache.get_client(full_key, write=True).lock(
+                f'{full_key}:lock', timeout=self._lock_timeout, blocking=False
+            )
+            deadline = time.monotonic() + self._lock_timeout
+            while not lock.acquire():
+                # Значение вычисляет другой процесс — ждём его, а не идём в базу сами
+                time.sleep(self._lock_poll_interval)
+                value = self.get(key, _MISSING, version=version)
+                if value is not _MISSING:
+                    return value
+                if time.monotonic() >= deadline:
+                    logger.warning('Timed out waiting for cache key %s, computing it locally', full_key)
+                    break
+            try:
+                value = default()
+                self.set(key, value, timeout=timeout, version=version)
+                return value
+            finally:
+                try:
+                    lock.release()
+                except LockError:
+                    pass
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_celery_results',
 
     'main',
@@ -67,6 +68,7 @@ INSTALLED_APPS = [
     'users',
     'orders',
     'payment',
+    'inventory',
 ]
 
 MIDDLEWARE = [
@@ -77,6 +79,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'cart.middleware.CartCountCookieMiddleware',
 ]
 
 ROOT_URLCONF = 'novella.urls'
@@ -93,6 +96,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'main.context_processors.fragrance_menu',
                 'main.context_processors.navigation_categories',
+                'cart.context_processors.cart_count_cookie',
             ],
         },
     },
@@ -157,6 +161,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Дисковый кэш копий изображений произвольного размера (/resize/<ширина>/<формат>/<путь>)
+RESIZE_CACHE_DIR = os.getenv('RESIZE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'resized'))
+RESIZE_CACHE_MAX_BYTES = int(os.getenv('RESIZE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -164,6 +172,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CART_SESSION_ID = 'cart'
 
+# Хранилище анонимной корзины: в сессии лежит только id, сама корзина — хэш в Redis.
+# cart.storage.SessionCartStorage вернёт прежнее поведение (корзина целиком в сессии),
+# cart.storage.DatabaseCartStorage — таблицы StoredCart. Корзина вошедшего пользователя всегда в базе
+CART_STORAGE = os.getenv('CART_STORAGE', 'cart.storage.RedisCartStorage')
+CART_REDIS_URL = os.getenv('CART_REDIS_URL', 'redis://localhost:6379/2')
+CART_TTL = 60 * 60 * 24 * 30
+# Кука с числом товаров для счётчика в шапке; читается из JavaScript
+CART_COUNT_COOKIE = 'cart_count'
+
+# Сколько остаток держится под неоплаченным заказом, прежде чем вернуться в продажу.
+# Сессия Stripe истекает вместе с бронью, а короче 30 минут Stripe её не создаёт
+RESERVATION_TTL = 60 * 40
+
+# Общий кэш для всех воркеров: версии каталога, страницы, фрагменты.
+# Перед Redis — короткоживущий LRU в памяти процесса, сбрасываемый через pub/sub
+CACHES = {
+    'default': {
+        'BACKEND': 'novella.cache.TieredRedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/1'),
+        'KEY_PREFIX': 'novella',
+        'OPTIONS': {
+            'L1_MAX_ENTRIES': 2000,
+            'L1_TIMEOUT': 5,
+            'LOCK_TIMEOUT': 10,
+        },
+    }
+}
+
+# Курсорная пагинация каталога (?after=/?before=) вместо ?page=
+CATALOG_KEYSET_PAGINATION = os.getenv('CATALOG_KEYSET_PAGINATION', 'False') == 'True'
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 # Celery settings
@@ -173,6 +212,21 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-carts': {
+        'task': 'cart.tasks.purge_expired_carts',
+        'schedule': 60 * 60,
+    },
+    'expire-stock-reservations': {
+        'task': 'inventory.tasks.expire_reservations',
+        'schedule': 60,
+    },
+    # Воркер должен видеть тот же RESIZE_CACHE_DIR, что и веб-процессы
+    'evict-resized-images': {
+        'task': 'main.tasks.evict_resized_images',
+        'schedule': 10 * 60,
+    },
+}
 
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -193,6 +247,8 @@ STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 # yookassa keys
 YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
 YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
+# Платежи двухстадийные: HTTP-уведомления payment.waiting_for_capture, payment.succeeded и payment.canceled
+# нужно подписать на /payment/yookassa/webhook/ — без первого деньги списываются только со страницы возврата
 YOOKASSA_VAT_CODE = 1  # Код НДС (1 - без НДС, уточните в документации YooKassa)
 
 # Инициализация YooKassa
@@ -1,5 +1,7 @@
 from django.contrib import admin
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
+from main.resize import resized_url
 from .models import Order, OrderItem, OrderSample, OrderGift
 
 
@@ -13,7 +15,8 @@ class OrderItemInline(admin.TabularInline):
 
     def image_preview(self, obj):
         if obj.perfume.image:
-            return mark_safe(f'<img src="{obj.perfume.image.url}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />')
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />',
+                               resized_url(obj.perfume.image.name, 200))
         return mark_safe('<span style="color: gray;">No image</span>')
     image_preview.short_description = 'Image'
 
@@ -36,7 +39,8 @@ class OrderSampleInline(admin.TabularInline):
 
     def image_preview(self, obj):
         if obj.sample.image:
-            return mark_safe(f'<img src="{obj.sample.image.url}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />')
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />',
+                               resized_url(obj.sample.image.name, 200))
         return mark_safe('<span style="color: gray;">No image</span>')
     image_preview.short_description = 'Image'
 
@@ -51,7 +55,8 @@ class OrderGiftInline(admin.TabularInline):
 
     def image_preview(self, obj):
         if obj.gift.image:
-            return mark_safe(f'<img src="{obj.gift.image.url}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />')
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px; object-fit: cover;" />',
+                               resized_url(obj.gift.image.name, 200))
         return mark_safe('<span style="color: gray;">No image</span>')
     image_preview.short_description = 'Image'
 
@@ -1,26 +1,30 @@
 from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from .forms import OrderForm
 from .models import Order, OrderItem, OrderSample, OrderGift
-from cart.cart import Cart
+from cart.cart import get_cart
 from promo.models import PromoCode
 from promo.forms import PromoCodeForm
 from decimal import Decimal
 import logging
 from payment.views import create_stripe_checkout_session, create_yookassa_payment
+from inventory.stock import InsufficientStock, reserve_order, release_order
 
 logger = logging.getLogger(__name__)
 
 
 @login_required(login_url='/users/login')
+# Остаток списывается в своей короткой транзакции: блокировки строк не держатся, пока ждём платёжную систему
+@transaction.non_atomic_requests
 def checkout(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if not cart:
         logger.warning("Empty cart, redirecting to cart_detail")
         return redirect('cart:cart_detail')
 
-    total_price = cart.get_total_price()
+    total_price = cart.get_snapshot().subtotal
     discount = Decimal(0)
     promo_message = ""
     promo_form = PromoCodeForm()
@@ -70,54 +74,70 @@ def checkout(request):
         payment_provider = request.POST.get('payment_provider', 'stripe')
 
         if form.is_valid():
-            order = Order.objects.create(
-                user=request.user,
-                first_name=form.cleaned_data['first_name'],
-                last_name=form.cleaned_data['last_name'],
-                email=form.cleaned_data['email'],
-                company=form.cleaned_data['company'],
-                address1=form.cleaned_data['address1'],
-                address2=form.cleaned_data['address2'],
-                city=form.cleaned_data['city'],
-                country=form.cleaned_data['country'],
-                province=form.cleaned_data['province'],
-                postal_code=form.cleaned_data['postal_code'],
-                phone=form.cleaned_data['phone'],
-                special_instructions=cart.cart.get('special_instructions', ''),
-                total_price=total_price,
-                discount_percentage=discount,
-            )
-
-            if 'promo_code' in request.session:
-                try:
-                    promo = PromoCode.objects.get(code=request.session['promo_code'], is_active=True)
-                    order.promo_code = promo
-                    order.save()
-                except PromoCode.DoesNotExist:
-                    logger.warning("Promo code not found during order creation")
-
-            for item in cart:
-                logger.debug(f"Processing cart item: {item}")
-                if item['type'] == 'product':
-                    OrderItem.objects.create(
-                        order=order,
-                        perfume=item['perfume'],
-                        capacity=item['capacity'],
-                        quantity=item['quantity'],
-                        price=item['price'] or Decimal('0.00')
-                    )
-                elif item['type'] == 'sample':
-                    OrderSample.objects.create(
-                        order=order,
-                        sample=item['sample']
-                    )
-                elif item['type'] == 'gift':
-                    OrderGift.objects.create(
-                        order=order,
-                        gift=item['gift'],
-                        price=item['price'] or Decimal('0.00')
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        user=request.user,
+                        first_name=form.cleaned_data['first_name'],
+                        last_name=form.cleaned_data['last_name'],
+                        email=form.cleaned_data['email'],
+                        company=form.cleaned_data['company'],
+                        address1=form.cleaned_data['address1'],
+                        address2=form.cleaned_data['address2'],
+                        city=form.cleaned_data['city'],
+                        country=form.cleaned_data['country'],
+                        province=form.cleaned_data['province'],
+                        postal_code=form.cleaned_data['postal_code'],
+                        phone=form.cleaned_data['phone'],
+                        special_instructions=cart.cart.get('special_instructions', ''),
+                        total_price=total_price,
+                        discount_percentage=discount,
                     )
 
+                    if 'promo_code' in request.session:
+                        try:
+                            promo = PromoCode.objects.get(code=request.session['promo_code'], is_active=True)
+                            order.promo_code = promo
+                            order.save()
+                        except PromoCode.DoesNotExist:
+                            logger.warning("Promo code not found during order creation")
+
+                    for item in cart:
+                        logger.debug(f"Processing cart item: {item}")
+                        if item['type'] == 'product':
+                            OrderItem.objects.create(
+                                order=order,
+                                perfume=item['perfume'],
+                                capacity=item['capacity'],
+                                quantity=item['quantity'],
+                                price=item['price'] or Decimal('0.00')
+                            )
+                        elif item['type'] == 'sample':
+                            OrderSample.objects.create(
+                                order=order,
+                                sample=item['sample']
+                            )
+                        elif item['type'] == 'gift':
+                            OrderGift.objects.create(
+                                order=order,
+                                gift=item['gift'],
+                                price=item['price'] or Decimal('0.00')
+                            )
+
+                    reserve_order(order)
+            except InsufficientStock as e:
+                logger.warning(f"Checkout stopped, {e}")
+                discounted_price = total_price * (Decimal(1) - discount / Decimal(100))
+                return render(request, 'orders/checkout.html', {
+                    'form': form,
+                    'cart': cart,
+                    'promo_form': promo_form,
+                    'discount': discount,
+                    'total_price': total_price,
+                    'discounted_price': discounted_price,
+                    'promo_message': 'Some items are no longer available in the requested quantity.',
+                })
+
             try:
                 if payment_provider == 'stripe':
                     checkout_session = create_stripe_checkout_session(order, request)
@@ -129,6 +149,7 @@ def checkout(request):
                     return redirect(payment.confirmation.confirmation_url)
             except Exception as e:
                 logger.error(f"Error creating payment: {str(e)}")
+                release_order(order)
                 order.delete()
                 discounted_price = total_price * (Decimal(1) - discount / Decimal(100))
                 return render(request, 'orders/checkout.html', {
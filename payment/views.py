@@ -3,10 +3,13 @@ from yookassa import Payment, Webhook
 from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404, render
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from orders.models import Order
-from cart.cart import Cart
+from cart.cart import get_cart
+from cart.storage import clear_user_cart
+from inventory.stock import commit_order, release_order, reservation_expires_at
 from decimal import Decimal
 import json
 import logging
@@ -24,7 +27,8 @@ Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
 
 
 def create_stripe_checkout_session(order, request):
-    cart = Cart(request)
+    # Та же корзина, что уже прочитало оформление заказа, — без повторных запросов
+    cart = get_cart(request)
     line_items = []
     for item in cart:
         if item['type'] == 'product':
@@ -51,9 +55,12 @@ def create_stripe_checkout_session(order, request):
             })
 
     discounted_total = order.get_discounted_total()
+    # Оплатить заказ после того, как бронь вернула остаток в продажу, нельзя
+    expires_at = reservation_expires_at(order)
     try:
         checkout_session = stripe.checkout.Session.create(
             payment_method_types=['card'],
+            **({'expires_at': int(expires_at.timestamp())} if expires_at else {}),
             line_items=line_items,
             mode='payment',
             success_url=request.build_absolute_uri('/payment/stripe/success/') + '?session_id={CHECKOUT_SESSION_ID}',
@@ -75,7 +82,7 @@ def create_stripe_checkout_session(order, request):
 EUR_TO_RUB_RATE = Decimal('100.00')  # 1 EUR = 100 RUB, настройте по вашим требованиям
 
 def create_yookassa_payment(order, request):
-    cart = Cart(request)
+    cart = get_cart(request)
     receipt_items = []
     for item in cart:
         if item['type'] == 'product':
@@ -123,7 +130,11 @@ def create_yookassa_payment(order, request):
                 "type": "redirect",
                 "return_url": request.build_absolute_uri('/payment/yookassa/success/') + f'?order_id={order.id}'
             },
-            "capture": True,
+            # Двухстадийный платёж: деньги списываются, только когда остаток за заказом закреплён
+            # (вебхук payment.waiting_for_capture или страница возврата), иначе платёж отменяется.
+            # В личном кабинете YooKassa должны быть подписаны payment.waiting_for_capture,
+            # payment.succeeded и payment.canceled
+            "capture": False,
             "description": f"Order #{order.id}",
             "metadata": {
                 "order_id": order.id,
@@ -144,6 +155,21 @@ def create_yookassa_payment(order, request):
         raise
 
 
+def settle_held_payment(order, payment_id):
+    """
+    Списывает удержанный платёж YooKassa, если остаток за заказом удалось закрепить, иначе отменяет его.
+    Вызывается из вебхука и со страницы возврата; одинаковые ключи идемпотентности не дают списать дважды.
+    order должен быть заблокирован select_for_update.
+    """
+    if commit_order(order, require_all=True):
+        payment = Payment.capture(payment_id, idempotency_key=f'capture-{payment_id}')
+        logger.info(f"Order {order.id} stock committed, payment captured")
+    else:
+        payment = Payment.cancel(payment_id, idempotency_key=f'cancel-{payment_id}')
+        logger.warning(f"Order {order.id} reservation lapsed and stock is gone, payment cancelled")
+    return payment
+
+
 @csrf_exempt
 @require_POST
 def stripe_webhook(request):
@@ -170,15 +196,11 @@ def stripe_webhook(request):
             order.status = 'processing'
             order.stripe_payment_intent_id = session.get('payment_intent')
             order.save()
+            commit_order(order)
             logger.info(f"Order {order_id} updated: status=processing, stripe_payment_intent_id={order.stripe_payment_intent_id}")
 
-            cart = Cart(request)
-            cart.clear()
-
-            for key in ['promo_code', 'discount_percentage', 'promo_message']:
-                if key in request.session:
-                    del request.session[key]
-                    logger.debug(f"Cleared session key: {key}")
+            # Вебхук приходит от платёжной системы, не от покупателя — чистим корзину владельца заказа
+            clear_user_cart(order.user)
         except Order.DoesNotExist:
             logger.error(f"Order {order_id} not found")
             return HttpResponse(status=404)
@@ -214,7 +236,11 @@ def yookassa_webhook(request):
 
         order = Order.objects.select_for_update().get(id=order_id, user_id=user_id)
 
-        if event_type == 'payment.succeeded':
+        if event_type == 'payment.waiting_for_capture':
+            if payment.get('status') == 'waiting_for_capture':
+                settle_held_payment(order, payment_id)
+
+        elif event_type == 'payment.succeeded':
             if payment.get('status') == 'succeeded':
                 if order.status == 'processing':
                     logger.info(f"Order {order_id} already processed, skipping")
@@ -223,15 +249,10 @@ def yookassa_webhook(request):
                 order.status = 'processing'
                 order.yookassa_payment_id = payment_id
                 order.save()
+                commit_order(order)
                 logger.info(f"Order {order_id} successfully processed")
 
-                cart = Cart(request)
-                cart.clear()
-
-                for key in ['promo_code', 'discount_percentage', 'promo_message']:
-                    if key in request.session:
-                        del request.session[key]
-                        logger.debug(f"Cleared session key: {key}")
+                clear_user_cart(order.user)
 
         elif event_type == 'payment.canceled':
             if payment.get('status') == 'canceled':
@@ -241,6 +262,7 @@ def yookassa_webhook(request):
                 
                 order.status = 'cancelled'
                 order.save()
+                release_order(order)
                 logger.info(f"Order {order_id} marked as cancelled")
 
         return HttpResponse(status=200)
@@ -256,12 +278,34 @@ def yookassa_webhook(request):
         return HttpResponse(status=500)
 
 
+def cancel_pending_order(order):
+    # Ссылку отмены открывает только владелец; оплаченный или уже отменённый заказ не трогаем,
+    # даже если вебхук оплаты пришёл одновременно с переходом по ссылке
+    if Order.objects.filter(pk=order.pk, status='pending').update(status='cancelled', updated_at=timezone.now()):
+        order.status = 'cancelled'
+        release_order(order)
+
+
+def finish_checkout(request, order):
+    # Вебхук приходит без сессии покупателя: промокод и счётчик корзины сбрасываем,
+    # когда сам покупатель вернулся на страницу успешной оплаты
+    if order.user_id != request.user.pk:
+        return
+    for key in ['promo_code', 'discount_percentage', 'promo_message']:
+        if key in request.session:
+            del request.session[key]
+            logger.debug(f"Cleared session key: {key}")
+    request.__dict__.pop('_cart', None)
+    request._cart_replaced = True
+
+
 def stripe_success(request):
     session_id = request.GET.get('session_id')
     if session_id:
         session = stripe.checkout.Session.retrieve(session_id)
         order_id = session.metadata['order_id']
         order = Order.objects.get(id=order_id)
+        finish_checkout(request, order)
         return render(request, 'payment/stripe_success.html', {'order': order})
     return redirect('main:home')
 
@@ -269,9 +313,8 @@ def stripe_success(request):
 def stripe_cancel(request):
     order_id = request.GET.get('order_id')
     if order_id:
-        order = get_object_or_404(Order, id=order_id)
-        order.status = 'cancelled'
-        order.save()
+        order = get_object_or_404(Order, id=order_id, user_id=request.user.pk)
+        cancel_pending_order(order)
         return render(request, 'payment/stripe_cancel.html', {'order': order})
     return redirect('orders:checkout')
 
@@ -281,19 +324,29 @@ def yookassa_success(request):
     if order_id:
         order = get_object_or_404(Order, id=order_id)
         if order.status == 'processing':
+            finish_checkout(request, order)
             return render(request, 'payment/yookassa_success.html', {'order': order})
         elif order.status == 'cancelled':
             return redirect('payment:yookassa_cancel')
         if order.yookassa_payment_id:
             try:
                 payment = Payment.find_one(order.yookassa_payment_id)
+                if payment.status == 'waiting_for_capture':
+                    # Уведомление payment.waiting_for_capture могло не прийти — без списания
+                    # YooKassa сама отменит удержание, хотя покупатель заплатил
+                    order = Order.objects.select_for_update().get(pk=order.pk)
+                    payment = settle_held_payment(order, payment.id)
                 if payment.status == 'succeeded':
                     order.status = 'processing'
                     order.save()
+                    commit_order(order)
+                    clear_user_cart(order.user)
+                    finish_checkout(request, order)
                     return render(request, 'payment/yookassa_success.html', {'order': order})
                 elif payment.status in ['canceled', 'failed']:
                     order.status = 'cancelled'
                     order.save()
+                    release_order(order)
                     return redirect('payment:yookassa_cancel')
             except Exception as e:
                 logger.error(f"Yookassa payment check error: {str(e)}")
@@ -303,8 +356,7 @@ def yookassa_success(request):
 def yookassa_cancel(request):
     order_id = request.GET.get('order_id')
     if order_id:
-        order = get_object_or_404(Order, id=order_id)
-        order.status = 'cancelled'
-        order.save()
+        order = get_object_or_404(Order, id=order_id, user_id=request.user.pk)
+        cancel_pending_order(order)
         return render(request, 'payment/yookassa_cancel.html', {'order': order})
     return redirect('orders:checkout')
@@ -12,7 +12,9 @@ from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 import logging
-from main.models import Perfume
+from main.models import CatalogCard
+from main.recommendations import similar_cards
+from orders.models import OrderItem
 from celery.result import AsyncResult
 from django.contrib import messages
 
@@ -112,8 +114,9 @@ def profile_view(request):
     else:
         form = CustomUserUpdateForm(instance=request.user)
     
-    # Получаем первые три доступных товара
-    recommended_perfumes = Perfume.objects.filter(available=True).order_by('id')[:3]
+    # Похожие на купленные ранее; без покупок — первые три доступных товара
+    purchased = OrderItem.objects.filter(order__user=request.user).values('perfume_id')
+    recommended_perfumes = list(similar_cards(purchased, limit=3)) or CatalogCard.objects.order_by('pk')[:3]
     
     return render(request, 'users/profile.html', {
         'form': form,